@@ -0,0 +1,129 @@
+import queue
+import threading
+
+from bitboard import NO_MOVE
+from chess_engine import Move
+from search import Searcher, SearchResult, MAX_PLY
+
+# Kinds of update put on the queue, each with the SearchResult it is about
+PONDER_INFO = "ponder"  # An iteration finished while thinking on the opponent's time
+INFO = "info"  # An iteration finished while thinking on our own time
+BEST_MOVE = "bestmove"  # The search is over, play result.best_move
+
+
+class AIPlayer:
+    # Runs the engine on a background thread so the UI's event loop never waits for a search. The search works on its
+    # own copy of the game and hands its progress to the UI through a queue, calling notify (from the search thread)
+    # whenever there is something new to poll. After playing a move it keeps searching on the reply it expects, and if
+    # the opponent plays that reply the search carries straight on as the search for the next move
+    def __init__(self, time_limit=2.0, hash_mb=16, ponder=True, notify=None, book=None, tablebases=None,
+                 instrumentation=None):
+        self.time_limit = time_limit
+        self.book = book  # An OpeningBook whose moves are played without searching
+        self.ponder_enabled = ponder
+        self.notify = notify
+        self.searcher = Searcher(hash_mb, tablebases=tablebases, instrumentation=instrumentation)
+        self.stop_event = threading.Event()  # Cancels the running search within a few hundred nodes
+        self.searcher.stop_event = self.stop_event
+        self.updates = queue.Queue()
+        self.thread = None
+        self.search_id = 0  # Updates from an earlier search are dropped by poll
+        self.move_pending = False  # think was called and poll hasn't handed out the move yet
+
+        # The search thread and the UI thread both decide whether a finished ponder search gets reported, under lock
+        self.lock = threading.Lock()
+        self.pondering = False
+        self.ponder_move = NO_MOVE  # The expected reply being pondered on
+        self.ponder_key = 0  # The key of the position after it
+        self.ponder_result = None  # The result of a ponder search that ended before the reply came
+
+    @property
+    def thinking(self):  # A move was asked for and hasn't been polled yet, even if the search itself is already done
+        return self.move_pending
+
+    def think(self, game_state):  # Starts searching for the side to move in game_state, or takes over a ponder search
+        if self.book is not None:
+            move = self.book.choose(game_state.position)
+            if move != NO_MOVE:
+                self.cancel()
+                self.move_pending = True
+                book_move = Move(move, game_state.position.mailbox)
+                self._publish(BEST_MOVE, self.search_id, SearchResult(book_move, [book_move], 0, 0, 0, 0.0))
+                return
+        if self.pondering:
+            position = game_state.position
+            last_move = game_state.move_log[-1].move if game_state.move_log else NO_MOVE
+            if last_move == self.ponder_move and position.key == self.ponder_key:
+                self.move_pending = True
+                with self.lock:
+                    self.pondering = False
+                    result = self.ponder_result
+                if result is not None:  # It already finished, the move is ready at once
+                    self._publish(BEST_MOVE, self.search_id, result)
+                else:  # Ponder hit, the time spent so far counts towards this move
+                    self.searcher.set_time_limit(self.time_limit)
+                return
+        self.cancel()
+        self.move_pending = True
+        self._start(game_state.copy(), self.time_limit, None, False)
+
+    def ponder(self, game_state, result):
+        # Searches, without a time limit, the position after the reply the last search expected. Called after the
+        # move of result was played on game_state
+        self.cancel()
+        if not self.ponder_enabled or len(result.pv) < 2:
+            return
+        reply = result.pv[1]
+        ponder_state = game_state.copy()
+        ponder_state.make_move(reply)
+        self.ponder_move = reply.move
+        self.ponder_key = ponder_state.position.key
+        self._start(ponder_state, None, MAX_PLY, True)
+
+    def cancel(self):  # Stops the running search, if any, and forgets its updates
+        if self.thread is not None:
+            self.stop_event.set()
+            self.thread.join()
+            self.thread = None
+            self.stop_event.clear()
+        self.pondering = False
+        self.move_pending = False
+        self.search_id += 1
+        while not self.updates.empty():
+            self.updates.get_nowait()
+
+    def poll(self):  # The (kind, SearchResult) updates of the current search since the last poll
+        updates = []
+        while not self.updates.empty():
+            search_id, kind, result = self.updates.get_nowait()
+            if search_id == self.search_id:
+                updates.append((kind, result))
+                if kind == BEST_MOVE:
+                    self.move_pending = False
+        return updates
+
+    def _start(self, game_state, time_limit, depth, pondering):
+        self.search_id += 1
+        self.pondering = pondering
+        self.ponder_result = None
+        self.thread = threading.Thread(target=self._search, args=(game_state, self.search_id, time_limit, depth),
+                                       daemon=True)
+        self.thread.start()
+
+    def _search(self, game_state, search_id, time_limit, depth):
+        def on_iteration(result):
+            self._publish(PONDER_INFO if self.pondering else INFO, search_id, result)
+
+        result = self.searcher.search(game_state, time_limit=time_limit, depth=depth, on_iteration=on_iteration)
+        if self.stop_event.is_set():
+            return  # Cancelled, nobody is waiting for it
+        with self.lock:
+            if self.pondering:
+                self.ponder_result = result  # Kept for think, in case the opponent plays the expected reply
+                return
+        self._publish(BEST_MOVE, search_id, result)
+
+    def _publish(self, kind, search_id, result):
+        self.updates.put((search_id, kind, result))
+        if self.notify is not None:
+            self.notify()
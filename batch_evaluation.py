@@ -0,0 +1,197 @@
+import argparse
+import random
+import time
+
+import numpy as np
+
+import evaluation
+from bitboard import WHITE, KNIGHT, BISHOP, ROOK, QUEEN, FULL, FILE_A, FILE_H, STARTING_FEN, Position
+
+# Plane order is the piece index, so planes[:, 0] are the white pawns and planes[:, 11] the black king. Every plane is
+# 8x8 in the same row/column layout as the squares
+FEATURES = 12 * 64  # Piece index * 64 + square
+
+# Bitboard steps as (bit shift, squares the result may land on), so nothing wraps around the edge of the board
+NOT_FILE_A = np.uint64(FULL ^ FILE_A)
+NOT_FILE_H = np.uint64(FULL ^ FILE_H)
+NOT_FILES_AB = np.uint64(FULL ^ FILE_A ^ (FILE_A << 1))
+NOT_FILES_GH = np.uint64(FULL ^ FILE_H ^ (FILE_H >> 1))
+ALL_FILES = np.uint64(FULL)
+FILE_MASKS = [np.uint64(FILE_A << f) for f in range(8)]
+ROW_MASKS = [np.uint64(0xFF << (r * 8)) for r in range(8)]
+KNIGHT_STEPS = [(17, NOT_FILE_A), (15, NOT_FILE_H), (10, NOT_FILES_AB), (6, NOT_FILES_GH),
+                (-17, NOT_FILE_H), (-15, NOT_FILE_A), (-10, NOT_FILES_GH), (-6, NOT_FILES_AB)]
+DIAGONAL_STEPS = [(9, NOT_FILE_A), (7, NOT_FILE_H), (-7, NOT_FILE_A), (-9, NOT_FILE_H)]
+STRAIGHT_STEPS = [(1, NOT_FILE_A), (-1, NOT_FILE_H), (8, ALL_FILES), (-8, ALL_FILES)]
+
+
+def board_planes(pieces):
+    # (N, 12, 8, 8) array of 0/1 from an (N, 12) array of bitboards: each bitboard's bytes are unpacked to its bits,
+    # lowest square first
+    pieces = np.ascontiguousarray(pieces, dtype="<u8")
+    bits = np.unpackbits(pieces.view(np.uint8), axis=-1, bitorder="little")
+    return bits.reshape(len(pieces), 12, 8, 8)
+
+
+def position_arrays(positions):  # The bitboards and sides of GameStates or Positions, ready for BatchEvaluator
+    positions = [getattr(position, "position", position) for position in positions]
+    pieces = np.array([position.pieces for position in positions], dtype=np.uint64).reshape(len(positions), 12)
+    sides = np.array([position.side for position in positions], dtype=np.int8)
+    return pieces, sides
+
+
+def _shift(bitboards, step):
+    return bitboards << np.uint64(step) if step > 0 else bitboards >> np.uint64(-step)
+
+
+def _popcount(bitboards):
+    if hasattr(np, "bitwise_count"):  # NumPy 2
+        return np.bitwise_count(bitboards).astype(np.int64)
+    bitboards = bitboards - ((bitboards >> np.uint64(1)) & np.uint64(0x5555555555555555))
+    bitboards = (bitboards & np.uint64(0x3333333333333333)) + ((bitboards >> np.uint64(2))
+                                                                & np.uint64(0x3333333333333333))
+    bitboards = (bitboards + (bitboards >> np.uint64(4))) & np.uint64(0x0F0F0F0F0F0F0F0F)
+    return ((bitboards * np.uint64(0x0101010101010101)) >> np.uint64(56)).astype(np.int64)
+
+
+def _slide(sliders, empty, step, landing):
+    # The squares every slider in the bitboards attacks in one direction, by Kogge-Stone fill: the rays grow 1, 2
+    # then 4 squares at a time through empty squares, then take one more step onto the blocker
+    empty = empty & landing
+    for distance in (step, 2 * step, 4 * step):
+        sliders = sliders | (empty & _shift(sliders, distance))
+        empty = empty & _shift(empty, distance)
+    return _shift(sliders, step) & landing
+
+
+class BatchEvaluator:
+    # Scores many positions in one go with the same features and weights as evaluation.evaluate, so the results are
+    # identical to the scalar evaluation, only the work is done by NumPy over the whole batch at once
+    def __init__(self, weights_path=None):
+        if weights_path is not None:
+            evaluation.load_weights(weights_path)
+        weights = evaluation.get_weights()
+        # Midgame value, endgame value and phase weight of every plane square, so one matrix product over the planes
+        # gives all three sums. They stay far below 2 ** 24, where float32 would start to round
+        self.plane_weights = np.stack([np.array(evaluation.MIDGAME_VALUES).reshape(FEATURES),
+                                       np.array(evaluation.ENDGAME_VALUES).reshape(FEATURES),
+                                       np.repeat(weights["phase_weights"] * 2, 64)], axis=1).astype(np.float32)
+        self.mobility_weights = weights["mobility_weights"]
+        self.doubled_pawn = weights["doubled_pawn"]
+        self.isolated_pawn = weights["isolated_pawn"]
+        self.passed_pawn = weights["passed_pawn"]
+
+    def evaluate(self, pieces, sides):  # Scores from the side to move's point of view, as an int64 array
+        pieces = np.asarray(pieces, dtype=np.uint64)
+        planes = board_planes(pieces)
+        sums = (planes.reshape(len(planes), FEATURES).astype(np.float32) @ self.plane_weights).astype(np.float64)
+        midgame, endgame = sums[:, 0], sums[:, 1]
+        phase = np.minimum(sums[:, 2], evaluation.MAX_PHASE)
+        tapered = np.trunc((midgame * phase + endgame * (evaluation.MAX_PHASE - phase)) / evaluation.MAX_PHASE)
+        score = tapered.astype(np.int64) + self._mobility(pieces) + self._pawn_structure(pieces)
+        return np.where(np.asarray(sides) == WHITE, score, -score)
+
+    def evaluate_positions(self, positions):  # The same for a list of GameStates or Positions
+        return self.evaluate(*position_arrays(positions))
+
+    def _mobility(self, pieces):
+        # Both sides at once, as (2, N) bitboards. Along any one step or direction no two pieces reach the same
+        # square, so the popcount of all their attacks together is the sum of each piece's count
+        sides = pieces.reshape(len(pieces), 2, 6).transpose(1, 2, 0)
+        own = np.bitwise_or.reduce(sides, axis=1)
+        not_own = ~own
+        empty = ~(own[0] | own[1])
+        weights = self.mobility_weights
+        score = np.zeros((2, len(pieces)), dtype=np.int64)
+        if weights[KNIGHT]:
+            for step, landing in KNIGHT_STEPS:
+                score += weights[KNIGHT] * _popcount(_shift(sides[:, KNIGHT], step) & landing & not_own)
+        for piece_type, steps in ((BISHOP, DIAGONAL_STEPS), (ROOK, STRAIGHT_STEPS), (QUEEN, DIAGONAL_STEPS),
+                                  (QUEEN, STRAIGHT_STEPS)):
+            if not weights[piece_type]:
+                continue
+            for step, landing in steps:
+                score += weights[piece_type] * _popcount(_slide(sides[:, piece_type], empty, step, landing) & not_own)
+        return score[WHITE] - score[1]
+
+    def _pawn_structure(self, pieces):
+        pawns = [pieces[:, 0], pieces[:, 6]]
+        score = np.zeros(len(pieces), dtype=np.int64)
+        for colour, sign in ((WHITE, 1), (1, -1)):
+            files = [_popcount(pawns[colour] & mask) for mask in FILE_MASKS]
+            for f in range(8):
+                neighbours = (files[f - 1] if f > 0 else 0) + (files[f + 1] if f < 7 else 0)
+                score += sign * (self.doubled_pawn * np.maximum(files[f] - 1, 0)
+                                 + self.isolated_pawn * files[f] * (neighbours == 0))
+
+        # The squares behind each side's pawns, spread to the adjacent files. A pawn of the other side standing on
+        # one of them has an enemy pawn in front of it on its own or a neighbouring file, otherwise it is passed
+        white_behind = pawns[WHITE] >> np.uint64(8)
+        black_behind = pawns[1] << np.uint64(8)
+        for distance in (8, 16, 32):
+            white_behind = white_behind | (white_behind >> np.uint64(distance))
+            black_behind = black_behind | (black_behind << np.uint64(distance))
+        white_blocks = white_behind | _shift(white_behind, 1) & NOT_FILE_A | _shift(white_behind, -1) & NOT_FILE_H
+        black_blocks = black_behind | _shift(black_behind, 1) & NOT_FILE_A | _shift(black_behind, -1) & NOT_FILE_H
+        white_passed = pawns[WHITE] & ~black_blocks
+        black_passed = pawns[1] & ~white_blocks
+        for row in range(1, 7):
+            score += self.passed_pawn[7 - row] * _popcount(white_passed & ROW_MASKS[row])
+            score -= self.passed_pawn[row] * _popcount(black_passed & ROW_MASKS[row])
+        return score
+
+
+def random_positions(count, seed=1):  # Positions from random games, for benchmarks
+    generator = random.Random(seed)
+    positions = []
+    while len(positions) < count:
+        position = Position.from_fen(STARTING_FEN)
+        for _ in range(generator.randrange(10, 120)):
+            moves = position.generate_moves()
+            if not moves:
+                break
+            position.make_move(generator.choice(moves))
+        positions.append(position)
+    return positions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the batch evaluation against one position at a time")
+    parser.add_argument("--count", type=int, default=10000, help="the number of positions to score")
+    parser.add_argument("--batch", type=int, default=1000, help="the positions scored per call")
+    parser.add_argument("--weights", help="a JSON weights file, as written by evaluation.save_weights")
+    parser.add_argument("--fen-file", help="score the positions in this file, one FEN string per line, instead")
+    args = parser.parse_args()
+
+    evaluator = BatchEvaluator(args.weights)
+    if args.fen_file:
+        with open(args.fen_file) as fen_file:
+            fens = [line.strip() for line in fen_file if line.strip()]
+        for start in range(0, len(fens), args.batch):
+            batch = fens[start:start + args.batch]
+            for fen, score in zip(batch, evaluator.evaluate_positions([Position.from_fen(fen) for fen in batch])):
+                print("{}  {}".format(score, fen))
+        return
+
+    positions = random_positions(args.count)
+    start_time = time.perf_counter()
+    scalar_scores = [evaluation.evaluate(position) for position in positions]
+    scalar_seconds = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    batch_scores = []
+    for start in range(0, len(positions), args.batch):
+        batch_scores.extend(evaluator.evaluate_positions(positions[start:start + args.batch]).tolist())
+    batch_seconds = time.perf_counter() - start_time
+
+    mismatches = sum(1 for scalar, batch in zip(scalar_scores, batch_scores) if scalar != batch)
+    print("scalar {:>10.0f} positions/s".format(len(positions) / scalar_seconds))
+    print("batch  {:>10.0f} positions/s  ({} per call, {:.1f}x)".format(len(positions) / batch_seconds, args.batch,
+                                                                       scalar_seconds / batch_seconds))
+    print("{} of {} scores differ from the scalar evaluation".format(mismatches, len(positions)))
+    if mismatches:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
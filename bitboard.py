@@ -0,0 +1,786 @@
+import random
+from array import array
+
+WHITE, BLACK = 0, 1
+PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING = range(6)
+
+# A piece index is colour * 6 + piece type, so 'wP' is 0 and 'bK' is 11
+PIECE_NAMES = ["wP", "wN", "wB", "wR", "wQ", "wK", "bP", "bN", "bB", "bR", "bQ", "bK"]
+PIECE_INDEX = {name: index for index, name in enumerate(PIECE_NAMES)}
+EMPTY = -1  # Mailbox value of an empty square
+NO_SQUARE = -1
+UNDO_STACK_SIZE = 512  # Moves the undo stack holds before it has to grow
+
+# Squares are numbered row * 8 + column with row 0 being black's back rank, the same layout as GameState.board
+FULL = (1 << 64) - 1
+FILE_A = sum(1 << (r * 8) for r in range(8))
+FILE_H = FILE_A << 7
+RANK_3 = 0xFF << 40  # Row 5, where a white pawn lands after a single push
+RANK_6 = 0xFF << 16  # Row 2, where a black pawn lands after a single push
+PROMOTION_RANKS = [0xFF, 0xFF << 56]  # The last row for each colour
+DARK_SQUARES = sum(1 << sq for sq in range(64) if (sq // 8 + sq % 8) % 2)  # a1 is dark, a8 light
+
+WHITE_KINGSIDE, WHITE_QUEENSIDE, BLACK_KINGSIDE, BLACK_QUEENSIDE = 1, 2, 4, 8
+CASTLING_FLAGS = [WHITE_KINGSIDE, WHITE_QUEENSIDE, BLACK_KINGSIDE, BLACK_QUEENSIDE]
+CASTLING_LETTERS = "KQkq"  # FEN letter of each castling flag
+STARTING_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+
+# Castling rights that survive a move touching the square; rook and king squares clear their rights
+CASTLING_RIGHTS_MASK = [15] * 64
+CASTLING_RIGHTS_MASK[60] = 15 ^ (WHITE_KINGSIDE | WHITE_QUEENSIDE)
+CASTLING_RIGHTS_MASK[63] = 15 ^ WHITE_KINGSIDE
+CASTLING_RIGHTS_MASK[56] = 15 ^ WHITE_QUEENSIDE
+CASTLING_RIGHTS_MASK[4] = 15 ^ (BLACK_KINGSIDE | BLACK_QUEENSIDE)
+CASTLING_RIGHTS_MASK[7] = 15 ^ BLACK_KINGSIDE
+CASTLING_RIGHTS_MASK[0] = 15 ^ BLACK_QUEENSIDE
+
+# (right, king start, king end, squares that must be empty, squares the king crosses, rook start, rook end)
+CASTLING_MOVES = [
+    [(WHITE_KINGSIDE, 60, 62, (1 << 61) | (1 << 62), (1 << 60) | (1 << 61) | (1 << 62), 63, 61),
+     (WHITE_QUEENSIDE, 60, 58, (1 << 57) | (1 << 58) | (1 << 59), (1 << 60) | (1 << 59) | (1 << 58), 56, 59)],
+    [(BLACK_KINGSIDE, 4, 6, (1 << 5) | (1 << 6), (1 << 4) | (1 << 5) | (1 << 6), 7, 5),
+     (BLACK_QUEENSIDE, 4, 2, (1 << 1) | (1 << 2) | (1 << 3), (1 << 4) | (1 << 3) | (1 << 2), 0, 3)],
+]
+CASTLING_SIDE_RIGHTS = [WHITE_KINGSIDE | WHITE_QUEENSIDE, BLACK_KINGSIDE | BLACK_QUEENSIDE]
+CASTLING_ROOK_SQUARES = {62: (63, 61), 58: (56, 59), 6: (7, 5), 2: (0, 3)}  # King end square -> rook move
+
+# A move is one int: start square | end square << 6 | promotion piece type << 12. It fits in 16 bits, so move lists
+# and the undo stack hold plain small ints instead of an object per move. A move never starts and ends on the same
+# square, so 0 is free to mean "no move". Captures, castling and en passant are read from the board, not the move
+NO_MOVE = 0
+MOVE_END_SHIFT = 6
+MOVE_PROMOTION_SHIFT = 12
+
+# What generate_moves produces. A search can ask for the tactical moves first and only generate the quiet ones when
+# none of those cut the node off
+ALL_MOVES = 0
+TACTICAL_MOVES = 1  # Captures, en passant and every promotion
+QUIET_MOVES = 2  # Everything else, castling included
+
+# The moves for a set of target squares, filled in the first time that set turns up. Pieces keep reaching the same
+# targets, so most generation becomes one dict lookup and a list extend instead of a loop over the bits
+TARGET_CACHE_LIMIT = 4096  # Entries per cache before it is cleared
+_TARGET_MOVES = [{} for _ in range(64)]  # Start square -> {target squares: moves}
+_PAWN_MOVES = {(offset, promotion): {} for offset in (8, -8, 16, -16, 9, 7, -7, -9) for promotion in (False, True)}
+# (Distance from the end square back to the start square, promotion) -> {end squares: moves}
+
+# Zobrist keys: a position's key is the XOR of the numbers for everything in it, so a move updates it with a few XORs
+_zobrist_random = random.Random(20201018)  # Fixed seed, keys stay the same between runs and processes
+ZOBRIST_PIECES = [[_zobrist_random.getrandbits(64) for _ in range(64)] for _ in range(12)]
+ZOBRIST_SIDE = _zobrist_random.getrandbits(64)  # Included when black is to move
+_zobrist_castling_flags = [_zobrist_random.getrandbits(64) for _ in range(4)]
+ZOBRIST_CASTLING = [0] * 16  # Indexed by the castling rights, the XOR of the number of each right held
+for _rights in range(16):
+    for _flag in range(4):
+        if _rights & (1 << _flag):
+            ZOBRIST_CASTLING[_rights] ^= _zobrist_castling_flags[_flag]
+ZOBRIST_EP_FILES = [_zobrist_random.getrandbits(64) for _ in range(8)]  # The file of the en passant square
+
+ROOK_DIRECTIONS = [(0, 1), (0, -1), (1, 0), (-1, 0)]
+BISHOP_DIRECTIONS = [(1, 1), (1, -1), (-1, 1), (-1, -1)]
+
+
+def square_name(sq):
+    return "abcdefgh"[sq % 8] + str(8 - sq // 8)
+
+
+def encode_move(start, end, promotion=0):
+    return start | end << MOVE_END_SHIFT | promotion << MOVE_PROMOTION_SHIFT
+
+
+def decode_move(move):  # (start square, end square, promotion piece type or 0)
+    return move & 63, move >> MOVE_END_SHIFT & 63, move >> MOVE_PROMOTION_SHIFT
+
+
+def move_to_uci(move):  # 'e2e4', or 'e7e8q' for a promotion
+    start, end, promotion = decode_move(move)
+    return square_name(start) + square_name(end) + (" nbrq"[promotion] if promotion else "")
+
+
+def squares(bb):  # The square numbers of the set bits, lowest first
+    while bb:
+        low = bb & -bb
+        yield low.bit_length() - 1
+        bb ^= low
+
+
+def _fill_target_moves(start, targets):
+    cache = _TARGET_MOVES[start]
+    if len(cache) >= TARGET_CACHE_LIMIT:
+        cache.clear()
+    moves = cache[targets] = tuple(start | end << MOVE_END_SHIFT for end in squares(targets))
+    return moves
+
+
+def _fill_pawn_moves(offset, promotion, targets):
+    cache = _PAWN_MOVES[offset, promotion]
+    if len(cache) >= TARGET_CACHE_LIMIT:
+        cache.clear()
+    if promotion:
+        moves = tuple(encode_move(end + offset, end, piece_type) for end in squares(targets)
+                      for piece_type in (QUEEN, ROOK, BISHOP, KNIGHT))
+    else:
+        moves = tuple(end + offset | end << MOVE_END_SHIFT for end in squares(targets))
+    cache[targets] = moves
+    return moves
+
+
+def _step_attacks(offsets):
+    table = []
+    for sq in range(64):
+        r, c = divmod(sq, 8)
+        attacks = 0
+        for dr, dc in offsets:
+            if 0 <= r + dr <= 7 and 0 <= c + dc <= 7:
+                attacks |= 1 << ((r + dr) * 8 + c + dc)
+        table.append(attacks)
+    return table
+
+
+KNIGHT_ATTACKS = _step_attacks([(1, 2), (2, 1), (-1, 2), (-2, 1), (1, -2), (2, -1), (-1, -2), (-2, -1)])
+KING_ATTACKS = _step_attacks([(1, 1), (1, 0), (1, -1), (0, 1), (0, -1), (-1, 1), (-1, 0), (-1, -1)])
+PAWN_ATTACKS = [_step_attacks([(-1, -1), (-1, 1)]), _step_attacks([(1, -1), (1, 1)])]  # Squares a pawn captures on
+
+
+def _ray_attacks(sq, occupied, directions):  # Slow reference walk, only used to fill the lookup tables
+    attacks = 0
+    r0, c0 = divmod(sq, 8)
+    for dr, dc in directions:
+        r, c = r0 + dr, c0 + dc
+        while 0 <= r <= 7 and 0 <= c <= 7:
+            bit = 1 << (r * 8 + c)
+            attacks |= bit
+            if occupied & bit:
+                break
+            r, c = r + dr, c + dc
+    return attacks
+
+
+def _relevant_mask(sq, directions):  # The squares whose occupancy can change the attacks (the ray minus its edge)
+    mask = 0
+    r0, c0 = divmod(sq, 8)
+    for dr, dc in directions:
+        r, c = r0 + dr, c0 + dc
+        while 0 <= r + dr <= 7 and 0 <= c + dc <= 7:
+            mask |= 1 << (r * 8 + c)
+            r, c = r + dr, c + dc
+    return mask
+
+
+def _sliding_tables(directions):
+    # The same idea as magic bitboards: a table per square indexed by the relevant occupancy. A dict keyed by the
+    # masked occupancy itself takes the place of the magic multiply and shift
+    masks, tables = [], []
+    for sq in range(64):
+        mask = _relevant_mask(sq, directions)
+        table = {}
+        subset = 0
+        while True:  # Walks every subset of the mask (Carry-Rippler)
+            table[subset] = _ray_attacks(sq, subset, directions)
+            subset = (subset - mask) & mask
+            if subset == 0:
+                break
+        masks.append(mask)
+        tables.append(table)
+    return masks, tables
+
+
+ROOK_MASKS, ROOK_TABLES = _sliding_tables(ROOK_DIRECTIONS)
+BISHOP_MASKS, BISHOP_TABLES = _sliding_tables(BISHOP_DIRECTIONS)
+
+
+def _line_tables():
+    between = [[0] * 64 for _ in range(64)]  # The squares strictly between two squares on a line
+    line = [[0] * 64 for _ in range(64)]  # The whole line through two squares, edge to edge
+    for a in range(64):
+        r0, c0 = divmod(a, 8)
+        for dr, dc in ROOK_DIRECTIONS + BISHOP_DIRECTIONS:
+            full_line = (1 << a) | _ray_attacks(a, 0, [(dr, dc), (-dr, -dc)])
+            passed = 0
+            r, c = r0 + dr, c0 + dc
+            while 0 <= r <= 7 and 0 <= c <= 7:
+                b = r * 8 + c
+                between[a][b] = passed
+                line[a][b] = full_line
+                passed |= 1 << b
+                r, c = r + dr, c + dc
+    return between, line
+
+
+BETWEEN, LINE = _line_tables()
+
+
+def rook_attacks(sq, occupied):
+    return ROOK_TABLES[sq][occupied & ROOK_MASKS[sq]]
+
+
+def bishop_attacks(sq, occupied):
+    return BISHOP_TABLES[sq][occupied & BISHOP_MASKS[sq]]
+
+
+def queen_attacks(sq, occupied):
+    return ROOK_TABLES[sq][occupied & ROOK_MASKS[sq]] | BISHOP_TABLES[sq][occupied & BISHOP_MASKS[sq]]
+
+
+class Position:  # One 64-bit integer per piece type and colour, plus a mailbox for "what is on this square"
+    def __init__(self):
+        self.pieces = [0] * 12  # Bitboards indexed by piece index
+        self.occupied = [0, 0]  # All white pieces, all black pieces
+        self.mailbox = [EMPTY] * 64  # The piece index on each square
+        self.side = WHITE
+        self.castling = 0  # A combination of the castling right flags
+        self.ep_square = NO_SQUARE  # The square a pawn can capture en passant on
+        self.halfmove_clock = 0
+        self.fullmove_number = 1
+        self.key = 0  # Zobrist key, updated by every change to the position
+
+        # The undo stack, preallocated so making a move never allocates. Entry i holds what move i overwrote
+        self.ply = 0  # The number of moves on the undo stack
+        self._undo_moves = array("H", bytes(2 * UNDO_STACK_SIZE))
+        self._undo_captured = [EMPTY] * UNDO_STACK_SIZE
+        self._undo_castling = [0] * UNDO_STACK_SIZE
+        self._undo_ep_squares = [NO_SQUARE] * UNDO_STACK_SIZE
+        self._undo_halfmove_clocks = [0] * UNDO_STACK_SIZE
+        self._undo_keys = [0] * UNDO_STACK_SIZE  # Also the key of every earlier position, for repetitions
+
+    @classmethod
+    def from_rows(cls, rows, side=WHITE):  # Builds a position from an 8x8 list of 'wP' / '--' strings
+        position = cls()
+        for r in range(8):
+            for c in range(8):
+                if rows[r][c] != "--":
+                    position.put_piece(PIECE_INDEX[rows[r][c]], r * 8 + c)
+        position.side = side
+        for right, king, _, _, _, rook, _ in CASTLING_MOVES[WHITE] + CASTLING_MOVES[BLACK]:
+            colour = WHITE if king == 60 else BLACK
+            if position.mailbox[king] == colour * 6 + KING and position.mailbox[rook] == colour * 6 + ROOK:
+                position.castling |= right
+        position.key = position.compute_key()
+        return position
+
+    @classmethod
+    def from_fen(cls, fen):
+        fields = fen.split()
+        position = cls()
+        for r, row in enumerate(fields[0].split("/")):
+            c = 0
+            for char in row:
+                if char.isdigit():
+                    c += int(char)
+                else:
+                    position.put_piece(PIECE_INDEX[("w" if char.isupper() else "b") + char.upper()], r * 8 + c)
+                    c += 1
+        position.side = WHITE if len(fields) < 2 or fields[1] == "w" else BLACK
+        if len(fields) > 2:
+            for right, letter in zip(CASTLING_FLAGS, CASTLING_LETTERS):
+                if letter in fields[2]:
+                    position.castling |= right
+        if len(fields) > 3 and fields[3] != "-":
+            sq = "abcdefgh".index(fields[3][0]) + (8 - int(fields[3][1])) * 8
+            if PAWN_ATTACKS[position.side ^ 1][sq] & position.pieces[position.side * 6 + PAWN]:
+                position.ep_square = sq  # Kept only when a pawn can capture, the same as after make_move
+        if len(fields) > 5:
+            position.halfmove_clock = int(fields[4])
+            position.fullmove_number = int(fields[5])
+        position.key = position.compute_key()
+        return position
+
+    def fen(self):
+        rows = []
+        for r in range(8):
+            row, empty = "", 0
+            for piece in self.mailbox[r * 8:r * 8 + 8]:
+                if piece == EMPTY:
+                    empty += 1
+                    continue
+                if empty:
+                    row, empty = row + str(empty), 0
+                name = PIECE_NAMES[piece]
+                row += name[1] if name[0] == "w" else name[1].lower()
+            rows.append(row + (str(empty) if empty else ""))
+        castling = "".join(letter for right, letter in zip(CASTLING_FLAGS, CASTLING_LETTERS) if self.castling & right)
+        return "{} {} {} {} {} {}".format("/".join(rows), "w" if self.side == WHITE else "b", castling or "-",
+                                          square_name(self.ep_square) if self.ep_square != NO_SQUARE else "-",
+                                          self.halfmove_clock, self.fullmove_number)
+
+    def copy(self):
+        position = Position()
+        position.pieces = self.pieces[:]
+        position.occupied = self.occupied[:]
+        position.mailbox = self.mailbox[:]
+        position.side = self.side
+        position.castling = self.castling
+        position.ep_square = self.ep_square
+        position.halfmove_clock = self.halfmove_clock
+        position.fullmove_number = self.fullmove_number
+        position.key = self.key
+        position.ply = self.ply
+        position._undo_moves = self._undo_moves[:]
+        position._undo_captured = self._undo_captured[:]
+        position._undo_castling = self._undo_castling[:]
+        position._undo_ep_squares = self._undo_ep_squares[:]
+        position._undo_halfmove_clocks = self._undo_halfmove_clocks[:]
+        position._undo_keys = self._undo_keys[:]
+        return position
+
+    def put_piece(self, piece, sq):
+        bit = 1 << sq
+        self.pieces[piece] |= bit
+        self.occupied[piece // 6] |= bit
+        self.mailbox[sq] = piece
+        self.key ^= ZOBRIST_PIECES[piece][sq]
+
+    def remove_piece(self, sq):
+        piece = self.mailbox[sq]
+        bit = 1 << sq
+        self.pieces[piece] &= ~bit
+        self.occupied[piece // 6] &= ~bit
+        self.mailbox[sq] = EMPTY
+        self.key ^= ZOBRIST_PIECES[piece][sq]
+        return piece
+
+    def compute_key(self):  # The Zobrist key worked out from scratch, make_move keeps self.key equal to it
+        key = ZOBRIST_CASTLING[self.castling]
+        for sq, piece in enumerate(self.mailbox):
+            if piece != EMPTY:
+                key ^= ZOBRIST_PIECES[piece][sq]
+        if self.side == BLACK:
+            key ^= ZOBRIST_SIDE
+        if self.ep_square != NO_SQUARE:
+            key ^= ZOBRIST_EP_FILES[self.ep_square & 7]
+        return key
+
+    def moves_played(self):  # The packed moves on the undo stack, oldest first
+        return self._undo_moves[:self.ply].tolist()
+
+    def is_repetition(self):  # True when the current position already occurred since the last irreversible move
+        key = self.key
+        undo_keys = self._undo_keys
+        # Only positions with the same side to move, and none from before a capture or pawn move, can match
+        for ply in range(self.ply - 2, max(self.ply - self.halfmove_clock, 0) - 1, -2):
+            if undo_keys[ply] == key:
+                return True
+        return False
+
+    def repetition_count(self):  # How many times the current position has occurred, this time included
+        key = self.key
+        undo_keys = self._undo_keys
+        return 1 + sum(1 for ply in range(self.ply - 2, max(self.ply - self.halfmove_clock, 0) - 1, -2)
+                       if undo_keys[ply] == key)
+
+    def is_insufficient_material(self):
+        # Neither side can ever mate: only kings and at most one minor piece, or bishops all on one square colour
+        pieces = self.pieces
+        if pieces[PAWN] | pieces[ROOK] | pieces[QUEEN] | pieces[6 + PAWN] | pieces[6 + ROOK] | pieces[6 + QUEEN]:
+            return False
+        knights = pieces[KNIGHT] | pieces[6 + KNIGHT]
+        bishops = pieces[BISHOP] | pieces[6 + BISHOP]
+        if (knights | bishops).bit_count() <= 1:
+            return True
+        return not knights and (not bishops & DARK_SQUARES or not bishops & ~DARK_SQUARES)
+
+    def king_square(self, side):
+        return self.pieces[side * 6 + KING].bit_length() - 1
+
+    def is_square_attacked(self, sq, by_side):
+        pieces = self.pieces
+        base = by_side * 6
+        occupied = self.occupied[0] | self.occupied[1]
+        if PAWN_ATTACKS[by_side ^ 1][sq] & pieces[base + PAWN]:
+            return True
+        if KNIGHT_ATTACKS[sq] & pieces[base + KNIGHT] or KING_ATTACKS[sq] & pieces[base + KING]:
+            return True
+        if BISHOP_TABLES[sq][occupied & BISHOP_MASKS[sq]] & (pieces[base + BISHOP] | pieces[base + QUEEN]):
+            return True
+        return bool(ROOK_TABLES[sq][occupied & ROOK_MASKS[sq]] & (pieces[base + ROOK] | pieces[base + QUEEN]))
+
+    def in_check(self, side=None):
+        if side is None:
+            side = self.side
+        return self.is_square_attacked(self.king_square(side), side ^ 1)
+
+    def attacked_squares(self, by_side, occupied):  # Every square the side attacks, with the given blockers
+        pieces = self.pieces
+        base = by_side * 6
+        pawns = pieces[base + PAWN]
+        if by_side == WHITE:
+            attacked = ((pawns & ~FILE_A) >> 9) | ((pawns & ~FILE_H) >> 7)
+        else:
+            attacked = (((pawns & ~FILE_A) << 7) | ((pawns & ~FILE_H) << 9)) & FULL
+        attacked |= KING_ATTACKS[pieces[base + KING].bit_length() - 1]
+        bb = pieces[base + KNIGHT]
+        while bb:
+            low = bb & -bb
+            attacked |= KNIGHT_ATTACKS[low.bit_length() - 1]
+            bb ^= low
+        queens = pieces[base + QUEEN]
+        for bb, masks, tables in ((pieces[base + BISHOP] | queens, BISHOP_MASKS, BISHOP_TABLES),
+                                  (pieces[base + ROOK] | queens, ROOK_MASKS, ROOK_TABLES)):
+            while bb:
+                low = bb & -bb
+                sq = low.bit_length() - 1
+                attacked |= tables[sq][occupied & masks[sq]]
+                bb ^= low
+        return attacked
+
+    def is_legal(self, move):
+        # Whether a packed move from somewhere else, such as a hash move or a killer, is legal here. Checking one
+        # move is much cheaper than generating them all to look it up
+        start = move & 63
+        end = move >> MOVE_END_SHIFT & 63
+        promotion = move >> MOVE_PROMOTION_SHIFT
+        mailbox = self.mailbox
+        piece = mailbox[start]
+        us = self.side
+        if piece == EMPTY or piece // 6 != us or start == end:
+            return False
+        captured = mailbox[end]
+        if captured != EMPTY and (captured // 6 == us or captured % 6 == KING):
+            return False
+        piece_type = piece % 6
+        end_bit = 1 << end
+        occupied = self.occupied[WHITE] | self.occupied[BLACK]
+        if piece_type == PAWN:
+            if promotion:
+                if not end_bit & PROMOTION_RANKS[us] or not KNIGHT <= promotion <= QUEEN:
+                    return False
+            elif end_bit & PROMOTION_RANKS[us]:
+                return False
+            push = -8 if us == WHITE else 8
+            if end == start + push:
+                if captured != EMPTY:
+                    return False
+            elif end == start + 2 * push:
+                if captured != EMPTY or mailbox[start + push] != EMPTY or start // 8 != (6 if us == WHITE else 1):
+                    return False
+            elif not PAWN_ATTACKS[us][start] & end_bit or captured == EMPTY and end != self.ep_square:
+                return False
+        elif promotion:
+            return False
+        elif piece_type == KING and abs(end - start) == 2:
+            if self.in_check():
+                return False
+            castles = []
+            self._castling_moves(castles, us, occupied, self.attacked_squares(us ^ 1, occupied))
+            return move in castles
+        elif piece_type == KNIGHT:
+            if not KNIGHT_ATTACKS[start] & end_bit:
+                return False
+        elif piece_type == KING:
+            if not KING_ATTACKS[start] & end_bit:
+                return False
+        elif not (piece_type != ROOK and BISHOP_TABLES[start][occupied & BISHOP_MASKS[start]] & end_bit
+                  or piece_type != BISHOP and ROOK_TABLES[start][occupied & ROOK_MASKS[start]] & end_bit):
+            return False
+        self.make_move(move)
+        legal = not self.in_check(us)
+        self.unmake_move()
+        return legal
+
+    def generate_moves(self, moves=None, kind=ALL_MOVES):
+        # Legal moves as packed ints. A list passed in is cleared and reused, so a search can keep one buffer per
+        # ply instead of allocating a new list at every node. kind limits them to TACTICAL_MOVES or QUIET_MOVES.
+        # Checkers, the check-blocking mask and the pinned pieces are worked out once, then every piece's targets
+        # are cut down to the legal ones, so no move needs a make, test and unmake pass
+        if moves is None:
+            moves = []
+        else:
+            moves.clear()
+        us = self.side
+        them = us ^ 1
+        pieces = self.pieces
+        own = self.occupied[us]
+        enemy = self.occupied[them]
+        occupied = own | enemy
+        not_own = ~own & FULL
+        if kind == TACTICAL_MOVES:
+            not_own = enemy
+        elif kind == QUIET_MOVES:
+            not_own &= ~enemy
+        target_moves = _TARGET_MOVES
+
+        king = pieces[us * 6 + KING].bit_length() - 1
+        enemy_base = them * 6
+        enemy_diagonal = pieces[enemy_base + BISHOP] | pieces[enemy_base + QUEEN]
+        enemy_straight = pieces[enemy_base + ROOK] | pieces[enemy_base + QUEEN]
+
+        # The king can't step onto an attacked square. It is taken off the board first so it doesn't shield the
+        # square behind it from a slider checking it
+        danger = self.attacked_squares(them, occupied ^ (1 << king))
+        targets = KING_ATTACKS[king] & not_own & ~danger
+        if targets:
+            cached = target_moves[king].get(targets)
+            moves += cached if cached is not None else _fill_target_moves(king, targets)
+
+        checkers = (KNIGHT_ATTACKS[king] & pieces[enemy_base + KNIGHT]) \
+            | (PAWN_ATTACKS[us][king] & pieces[enemy_base + PAWN]) \
+            | (BISHOP_TABLES[king][occupied & BISHOP_MASKS[king]] & enemy_diagonal) \
+            | (ROOK_TABLES[king][occupied & ROOK_MASKS[king]] & enemy_straight)
+        if checkers:
+            if checkers & (checkers - 1):
+                return moves  # Double check, only the king can move
+            check_mask = checkers | BETWEEN[king][checkers.bit_length() - 1]  # Capture the checker or block it
+        else:
+            check_mask = FULL
+            if kind != TACTICAL_MOVES:
+                self._castling_moves(moves, us, occupied, danger)
+
+        # An enemy slider that would see the king through exactly one of our pieces pins that piece to their line
+        pinned = 0
+        pin_lines = None
+        snipers = (BISHOP_TABLES[king][enemy & BISHOP_MASKS[king]] & enemy_diagonal) \
+            | (ROOK_TABLES[king][enemy & ROOK_MASKS[king]] & enemy_straight)
+        while snipers:
+            low = snipers & -snipers
+            sniper = low.bit_length() - 1
+            snipers ^= low
+            blockers = BETWEEN[king][sniper] & occupied
+            if blockers & own and not blockers & (blockers - 1):
+                pinned |= blockers
+                if pin_lines is None:
+                    pin_lines = {}
+                pin_lines[blockers] = LINE[king][sniper]
+
+        base = us * 6
+        pawns = pieces[base + PAWN]
+        self._pawn_moves(moves, pawns & ~pinned, us, enemy, occupied, check_mask, kind)
+        if pinned & pawns:
+            for start in squares(pinned & pawns):
+                self._pawn_moves(moves, 1 << start, us, enemy, occupied, check_mask & pin_lines[1 << start], kind)
+        if self.ep_square != NO_SQUARE and kind != QUIET_MOVES:
+            self._en_passant_moves(moves, pawns, king, checkers, occupied, enemy_diagonal, enemy_straight)
+
+        legal = not_own & check_mask
+        queens = pieces[base + QUEEN]
+        for bb, masks, tables in ((pieces[base + KNIGHT] & ~pinned, None, KNIGHT_ATTACKS),
+                                  (pieces[base + BISHOP] | queens, BISHOP_MASKS, BISHOP_TABLES),
+                                  (pieces[base + ROOK] | queens, ROOK_MASKS, ROOK_TABLES)):
+            while bb:
+                low = bb & -bb
+                start = low.bit_length() - 1
+                bb ^= low
+                if masks is None:
+                    targets = tables[start] & legal
+                else:
+                    targets = tables[start][occupied & masks[start]] & legal
+                    if low & pinned:
+                        targets &= pin_lines[low]
+                if targets:
+                    cached = target_moves[start].get(targets)
+                    moves += cached if cached is not None else _fill_target_moves(start, targets)
+        return moves
+
+    def _pawn_moves(self, moves, pawns, us, enemy, occupied, target_mask, kind=ALL_MOVES):
+        if not pawns:
+            return
+        empty = ~occupied & FULL
+        promotion_rank = PROMOTION_RANKS[us]
+        if kind == TACTICAL_MOVES:
+            empty &= promotion_rank  # Only pushes that promote
+        elif kind == QUIET_MOVES:
+            empty &= ~promotion_rank
+            enemy = 0
+        if us == WHITE:
+            single = (pawns >> 8) & empty
+            double = ((single & RANK_3) >> 8) & empty
+            left = ((pawns & ~FILE_A) >> 9) & enemy
+            right = ((pawns & ~FILE_H) >> 7) & enemy
+            push = 8
+            left_offset, right_offset = 9, 7  # Distance from the end square back to the start square
+        else:
+            single = (pawns << 8) & empty
+            double = ((single & RANK_6) << 8) & empty
+            left = ((pawns & ~FILE_A) << 7) & enemy
+            right = ((pawns & ~FILE_H) << 9) & enemy
+            push = -8
+            left_offset, right_offset = -7, -9
+
+        for targets, offset in ((single, push), (left, left_offset), (right, right_offset), (double, 2 * push)):
+            targets &= target_mask
+            if targets:
+                promotions = targets & promotion_rank
+                if promotions:
+                    targets ^= promotions
+                    cached = _PAWN_MOVES[offset, True].get(promotions)
+                    moves += cached if cached is not None else _fill_pawn_moves(offset, True, promotions)
+                if targets:
+                    cached = _PAWN_MOVES[offset, False].get(targets)
+                    moves += cached if cached is not None else _fill_pawn_moves(offset, False, targets)
+
+    def _en_passant_moves(self, moves, pawns, king, checkers, occupied, enemy_diagonal, enemy_straight):
+        ep_square = self.ep_square
+        us = self.side
+        captured_bit = 1 << (ep_square + 8 if us == WHITE else ep_square - 8)
+        if checkers & ~captured_bit & ~enemy_diagonal & ~enemy_straight:
+            return  # A knight or pawn check that capturing this pawn doesn't remove
+        # Two pawns leave the rank at once, so pins are checked on the board as it would be after the capture. This
+        # also catches the king and an enemy rook on the same rank with only the two pawns between them
+        for start in squares(PAWN_ATTACKS[us ^ 1][ep_square] & pawns):
+            after = occupied ^ (1 << start) ^ captured_bit ^ (1 << ep_square)
+            if not BISHOP_TABLES[king][after & BISHOP_MASKS[king]] & enemy_diagonal \
+                    and not ROOK_TABLES[king][after & ROOK_MASKS[king]] & enemy_straight:
+                moves.append(start | ep_square << MOVE_END_SHIFT)
+
+    def _castling_moves(self, moves, us, occupied, danger):
+        castling = self.castling
+        if not castling & CASTLING_SIDE_RIGHTS[us]:
+            return
+        for right, king_start, king_end, between, crossed, _, _ in CASTLING_MOVES[us]:
+            if castling & right and not occupied & between and not danger & crossed:
+                # The king may not castle out of, through or into check
+                moves.append(king_start | king_end << MOVE_END_SHIFT)
+
+    def make_move(self, move):
+        start = move & 63
+        end = move >> MOVE_END_SHIFT & 63
+        promotion = move >> MOVE_PROMOTION_SHIFT
+        pieces = self.pieces
+        occupied = self.occupied
+        mailbox = self.mailbox
+        us = self.side
+        them = us ^ 1
+        piece = mailbox[start]
+        captured = mailbox[end]
+        start_bit = 1 << start
+        end_bit = 1 << end
+
+        # Everything the move itself can't tell unmake_move goes on the undo stack
+        ply = self.ply
+        if ply == len(self._undo_moves):
+            self._grow_undo_stack()
+        ep_square = self.ep_square
+        self._undo_moves[ply] = move
+        self._undo_castling[ply] = self.castling
+        self._undo_ep_squares[ply] = ep_square
+        self._undo_halfmove_clocks[ply] = self.halfmove_clock
+        self._undo_keys[ply] = key = self.key
+        self.ply = ply + 1
+
+        zobrist = ZOBRIST_PIECES
+        key ^= ZOBRIST_SIDE ^ zobrist[piece][start] ^ zobrist[piece][end]
+        if ep_square != NO_SQUARE:
+            key ^= ZOBRIST_EP_FILES[ep_square & 7]
+        self.halfmove_clock += 1
+        if captured != EMPTY:
+            pieces[captured] ^= end_bit
+            occupied[them] ^= end_bit
+            key ^= zobrist[captured][end]
+            self.halfmove_clock = 0
+        pieces[piece] ^= start_bit | end_bit
+        occupied[us] ^= start_bit | end_bit
+        mailbox[start] = EMPTY
+        mailbox[end] = piece
+
+        self.ep_square = NO_SQUARE
+        piece_type = piece - us * 6
+        if piece_type == PAWN:
+            self.halfmove_clock = 0
+            if end == ep_square:
+                captured_square = end + 8 if us == WHITE else end - 8
+                captured = mailbox[captured_square]
+                pieces[captured] ^= 1 << captured_square
+                occupied[them] ^= 1 << captured_square
+                mailbox[captured_square] = EMPTY
+                key ^= zobrist[captured][captured_square]
+            elif end - start in (16, -16):
+                middle = (start + end) // 2
+                if PAWN_ATTACKS[us][middle] & pieces[them * 6 + PAWN]:
+                    self.ep_square = middle  # Only recorded when an enemy pawn can actually use it
+                    key ^= ZOBRIST_EP_FILES[middle & 7]
+            elif promotion:
+                pieces[piece] ^= end_bit
+                pieces[us * 6 + promotion] |= end_bit
+                mailbox[end] = us * 6 + promotion
+                key ^= zobrist[piece][end] ^ zobrist[us * 6 + promotion][end]
+        elif piece_type == KING and end - start in (2, -2):
+            rook_start, rook_end = CASTLING_ROOK_SQUARES[end]
+            rook_bits = (1 << rook_start) | (1 << rook_end)
+            rook = us * 6 + ROOK
+            pieces[rook] ^= rook_bits
+            occupied[us] ^= rook_bits
+            mailbox[rook_end] = rook
+            mailbox[rook_start] = EMPTY
+            key ^= zobrist[rook][rook_start] ^ zobrist[rook][rook_end]
+
+        self._undo_captured[ply] = captured
+        castling = self.castling
+        if castling:
+            self.castling &= CASTLING_RIGHTS_MASK[start] & CASTLING_RIGHTS_MASK[end]
+            key ^= ZOBRIST_CASTLING[castling] ^ ZOBRIST_CASTLING[self.castling]
+        self.key = key
+        if us == BLACK:
+            self.fullmove_number += 1
+        self.side = them
+
+    def unmake_move(self):  # Takes back the last move made with make_move
+        ply = self.ply - 1
+        self.ply = ply
+        move = self._undo_moves[ply]
+        start = move & 63
+        end = move >> MOVE_END_SHIFT & 63
+        captured = self._undo_captured[ply]
+        ep_square = self.ep_square = self._undo_ep_squares[ply]
+        self.castling = self._undo_castling[ply]
+        self.halfmove_clock = self._undo_halfmove_clocks[ply]
+        self.key = self._undo_keys[ply]
+
+        pieces = self.pieces
+        occupied = self.occupied
+        mailbox = self.mailbox
+        them = self.side
+        us = self.side = them ^ 1
+        if us == BLACK:
+            self.fullmove_number -= 1
+
+        start_bit = 1 << start
+        end_bit = 1 << end
+        piece = mailbox[end]
+        if move >> MOVE_PROMOTION_SHIFT:  # The promoted piece turns back into the pawn
+            pieces[piece] ^= end_bit
+            piece = us * 6 + PAWN
+            pieces[piece] ^= end_bit
+        pieces[piece] ^= start_bit | end_bit
+        occupied[us] ^= start_bit | end_bit
+        mailbox[start] = piece
+        mailbox[end] = EMPTY
+
+        piece_type = piece - us * 6
+        if piece_type == PAWN and end == ep_square:
+            captured_square = end + 8 if us == WHITE else end - 8
+            pieces[captured] ^= 1 << captured_square
+            occupied[them] ^= 1 << captured_square
+            mailbox[captured_square] = captured
+        elif captured != EMPTY:
+            pieces[captured] ^= end_bit
+            occupied[them] ^= end_bit
+            mailbox[end] = captured
+        elif piece_type == KING and end - start in (2, -2):
+            rook_start, rook_end = CASTLING_ROOK_SQUARES[end]
+            rook_bits = (1 << rook_start) | (1 << rook_end)
+            pieces[us * 6 + ROOK] ^= rook_bits
+            occupied[us] ^= rook_bits
+            mailbox[rook_start] = mailbox[rook_end]
+            mailbox[rook_end] = EMPTY
+
+    def _grow_undo_stack(self):  # Doubles the preallocated undo stack, only needed for very long games
+        size = max(len(self._undo_moves), 1)
+        self._undo_moves.frombytes(bytes(2 * size))
+        self._undo_captured.extend([EMPTY] * size)
+        self._undo_castling.extend([0] * size)
+        self._undo_ep_squares.extend([NO_SQUARE] * size)
+        self._undo_halfmove_clocks.extend([0] * size)
+        self._undo_keys.extend([0] * size)
+
+
+class BoardView:  # Lets the UI keep reading squares as board[row][column] == 'wP' / '--'
+    def __init__(self, position):
+        self.position = position
+
+    def __getitem__(self, row):
+        return [PIECE_NAMES[piece] if piece != EMPTY else "--" for piece in self.position.mailbox[row * 8:row * 8 + 8]]
+
+    def __iter__(self):
+        return (self[row] for row in range(8))
+
+    def __len__(self):
+        return 8
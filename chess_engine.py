@@ -0,0 +1,90 @@
+from bitboard import Position, BoardView, PIECE_NAMES, EMPTY, WHITE, KNIGHT, BISHOP, ROOK, QUEEN, MOVE_END_SHIFT, \
+    MOVE_PROMOTION_SHIFT
+
+PROMOTION_LETTERS = {KNIGHT: "N", BISHOP: "B", ROOK: "R", QUEEN: "Q"}
+PROMOTION_TYPES = {letter: piece_type for piece_type, letter in PROMOTION_LETTERS.items()}
+
+STARTING_BOARD = [["bR", "bN", "bB", "bQ", "bK", "bB", "bN", "bR"],
+                  ["bP", "bP", "bP", "bP", "bP", "bP", "bP", "bP"],
+                  ["--", "--", "--", "--", "--", "--", "--", "--"],
+                  ["--", "--", "--", "--", "--", "--", "--", "--"],
+                  ["--", "--", "--", "--", "--", "--", "--", "--"],
+                  ["--", "--", "--", "--", "--", "--", "--", "--"],
+                  ["wP", "wP", "wP", "wP", "wP", "wP", "wP", "wP"],
+                  ["wR", "wN", "wB", "wQ", "wK", "wB", "wN", "wR"]]
+
+
+class GameState:
+    def __init__(self, fen=None):
+        # The bitboards every move is generated from, the usual starting board unless a FEN string is given
+        self.position = Position.from_fen(fen) if fen else Position.from_rows(STARTING_BOARD)
+        self.board = BoardView(self.position)  # Read-only board[row][column] view used by the UI
+
+        self.pawn_promotion = ()  # The row and column of the pawn waiting for the user to pick a promotion
+        self.move_log = []  # A list containing all moves performed
+
+    @property
+    def white_turn(self):
+        return self.position.side == WHITE
+
+    def make_move(self, move):
+        self.position.make_move(move.move)
+        self.move_log.append(move)
+
+    def undo_move(self):
+        if self.move_log:  # If the move log is not empty
+            self.move_log.pop()
+            self.position.unmake_move()  # Restores the board, castling, en passant and the halfmove clock
+
+    def copy(self):  # A separate game to search in, so the board the UI draws from is never touched
+        game_state = GameState()
+        game_state.position = self.position.copy()
+        game_state.board = BoardView(game_state.position)
+        game_state.move_log = self.move_log[:]
+        return game_state
+
+    def is_threefold_repetition(self):  # Checked from the position keys of the moves in the move log
+        return self.position.repetition_count() >= 3
+
+    def get_valid_moves(self):
+        # The legal moves keyed by (start square, end square), so a click is found with one dict lookup instead of
+        # a scan. A pawn reaching the last row has one Move per promotion piece under the same key
+        mailbox = self.position.mailbox
+        valid_moves = {}
+        for move in self.position.generate_moves():
+            wrapped = Move(move, mailbox)
+            squares = (wrapped.start_square, wrapped.end_square)
+            if squares in valid_moves:
+                valid_moves[squares].append(wrapped)
+            else:
+                valid_moves[squares] = [wrapped]
+        return valid_moves
+
+
+class Move:  # A thin wrapper around a packed move for the UI, the engine itself only works with the packed ints
+    __slots__ = ("move", "piece_to_move", "piece_to_capture")
+
+    def __init__(self, move, mailbox):
+        self.move = move
+        moved = mailbox[move & 63]
+        captured = mailbox[move >> MOVE_END_SHIFT & 63]
+        self.piece_to_move = PIECE_NAMES[moved] if moved != EMPTY else "--"
+        self.piece_to_capture = PIECE_NAMES[captured] if captured != EMPTY else "--"
+
+    @property
+    def start_square(self):  # (row, column)
+        return divmod(self.move & 63, 8)
+
+    @property
+    def end_square(self):
+        return divmod(self.move >> MOVE_END_SHIFT & 63, 8)
+
+    @property
+    def promotion(self):  # The piece type a pawn promotes to, 0 for other moves
+        return self.move >> MOVE_PROMOTION_SHIFT
+
+    def __eq__(self, other):
+        return isinstance(other, Move) and self.move == other.move
+
+    def __hash__(self):
+        return self.move
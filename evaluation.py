@@ -0,0 +1,220 @@
+import json
+
+from bitboard import WHITE, BLACK, PAWN, KNIGHT, BISHOP, ROOK, QUEEN, FULL, FILE_A, KNIGHT_ATTACKS, BISHOP_MASKS, \
+    BISHOP_TABLES, ROOK_MASKS, ROOK_TABLES, squares
+
+PIECE_VALUES = [100, 320, 330, 500, 900, 0]  # Pawn, knight, bishop, rook, queen, king in centipawns
+PHASE_WEIGHTS = [0, 1, 1, 2, 4, 0]  # How much each piece counts towards the middlegame
+MAX_PHASE = 24  # The phase of the starting position
+
+# Centipawns per square a piece attacks that isn't taken by its own side. Pawns and kings aren't counted
+MOBILITY_WEIGHTS = [0, 4, 5, 2, 1, 0]
+DOUBLED_PAWN = -10  # For each pawn on a file after the first
+ISOLATED_PAWN = -15  # For each pawn with no pawns of its own side on the files next to it
+PASSED_PAWN = [0, 5, 10, 20, 35, 60, 100, 0]  # By the pawn's rank counted from its own side, so [1] is the start rank
+PAWN_CACHE_LIMIT = 16384  # Pawn structures kept before the cache is cleared
+
+# Piece-square tables from white's point of view, laid out like GameState.board (row 0 is the eighth rank)
+PAWN_TABLE = [0, 0, 0, 0, 0, 0, 0, 0,
+              50, 50, 50, 50, 50, 50, 50, 50,
+              10, 10, 20, 30, 30, 20, 10, 10,
+              5, 5, 10, 25, 25, 10, 5, 5,
+              0, 0, 0, 20, 20, 0, 0, 0,
+              5, -5, -10, 0, 0, -10, -5, 5,
+              5, 10, 10, -20, -20, 10, 10, 5,
+              0, 0, 0, 0, 0, 0, 0, 0]
+
+KNIGHT_TABLE = [-50, -40, -30, -30, -30, -30, -40, -50,
+                -40, -20, 0, 0, 0, 0, -20, -40,
+                -30, 0, 10, 15, 15, 10, 0, -30,
+                -30, 5, 15, 20, 20, 15, 5, -30,
+                -30, 0, 15, 20, 20, 15, 0, -30,
+                -30, 5, 10, 15, 15, 10, 5, -30,
+                -40, -20, 0, 5, 5, 0, -20, -40,
+                -50, -40, -30, -30, -30, -30, -40, -50]
+
+BISHOP_TABLE = [-20, -10, -10, -10, -10, -10, -10, -20,
+                -10, 0, 0, 0, 0, 0, 0, -10,
+                -10, 0, 5, 10, 10, 5, 0, -10,
+                -10, 5, 5, 10, 10, 5, 5, -10,
+                -10, 0, 10, 10, 10, 10, 0, -10,
+                -10, 10, 10, 10, 10, 10, 10, -10,
+                -10, 5, 0, 0, 0, 0, 5, -10,
+                -20, -10, -10, -10, -10, -10, -10, -20]
+
+ROOK_TABLE = [0, 0, 0, 0, 0, 0, 0, 0,
+              5, 10, 10, 10, 10, 10, 10, 5,
+              -5, 0, 0, 0, 0, 0, 0, -5,
+              -5, 0, 0, 0, 0, 0, 0, -5,
+              -5, 0, 0, 0, 0, 0, 0, -5,
+              -5, 0, 0, 0, 0, 0, 0, -5,
+              -5, 0, 0, 0, 0, 0, 0, -5,
+              0, 0, 0, 5, 5, 0, 0, 0]
+
+QUEEN_TABLE = [-20, -10, -10, -5, -5, -10, -10, -20,
+               -10, 0, 0, 0, 0, 0, 0, -10,
+               -10, 0, 5, 5, 5, 5, 0, -10,
+               -5, 0, 5, 5, 5, 5, 0, -5,
+               0, 0, 5, 5, 5, 5, 0, -5,
+               -10, 5, 5, 5, 5, 5, 0, -10,
+               -10, 0, 5, 0, 0, 0, 0, -10,
+               -20, -10, -10, -5, -5, -10, -10, -20]
+
+KING_MIDGAME_TABLE = [-30, -40, -40, -50, -50, -40, -40, -30,
+                      -30, -40, -40, -50, -50, -40, -40, -30,
+                      -30, -40, -40, -50, -50, -40, -40, -30,
+                      -30, -40, -40, -50, -50, -40, -40, -30,
+                      -20, -30, -30, -40, -40, -30, -30, -20,
+                      -10, -20, -20, -20, -20, -20, -20, -10,
+                      20, 20, 0, 0, 0, 0, 20, 20,
+                      20, 30, 10, 0, 0, 10, 30, 20]
+
+KING_ENDGAME_TABLE = [-50, -40, -30, -20, -20, -30, -40, -50,
+                      -30, -20, -10, 0, 0, -10, -20, -30,
+                      -30, -10, 20, 30, 30, 20, -10, -30,
+                      -30, -10, 30, 40, 40, 30, -10, -30,
+                      -30, -10, 30, 40, 40, 30, -10, -30,
+                      -30, -10, 20, 30, 30, 20, -10, -30,
+                      -30, -30, 0, 0, 0, 0, -30, -30,
+                      -50, -30, -30, -30, -30, -30, -30, -50]
+
+MIDGAME_TABLES = [PAWN_TABLE, KNIGHT_TABLE, BISHOP_TABLE, ROOK_TABLE, QUEEN_TABLE, KING_MIDGAME_TABLE]
+ENDGAME_TABLES = [PAWN_TABLE, KNIGHT_TABLE, BISHOP_TABLE, ROOK_TABLE, QUEEN_TABLE, KING_ENDGAME_TABLE]
+
+
+def _signed_tables(tables):
+    # Material plus square bonus for each piece index, negated for black and mirrored so black reads its own ranks
+    signed = []
+    for colour in range(2):
+        for piece_type in range(6):
+            if colour == WHITE:
+                signed.append([PIECE_VALUES[piece_type] + tables[piece_type][sq] for sq in range(64)])
+            else:
+                signed.append([-PIECE_VALUES[piece_type] - tables[piece_type][sq ^ 56] for sq in range(64)])
+    return signed
+
+
+MIDGAME_VALUES = _signed_tables(MIDGAME_TABLES)
+ENDGAME_VALUES = _signed_tables(ENDGAME_TABLES)
+
+FILE_MASKS = [FILE_A << f for f in range(8)]
+ADJACENT_FILES = [(FILE_MASKS[f - 1] if f > 0 else 0) | (FILE_MASKS[f + 1] if f < 7 else 0) for f in range(8)]
+# The squares in front of a pawn on its own and the adjacent files, where an enemy pawn stops it being passed
+PASSED_MASKS = [[((1 << (sq // 8 * 8)) - 1) & (FILE_MASKS[sq % 8] | ADJACENT_FILES[sq % 8]) for sq in range(64)],
+                [(FULL ^ ((1 << (sq // 8 * 8 + 8)) - 1)) & (FILE_MASKS[sq % 8] | ADJACENT_FILES[sq % 8])
+                 for sq in range(64)]]
+_pawn_cache = {}  # (white pawns, black pawns) -> pawn structure score, the pawns change far less often than the rest
+
+WEIGHT_NAMES = ["piece_values", "phase_weights", "midgame_tables", "endgame_tables", "mobility_weights",
+                "doubled_pawn", "isolated_pawn", "passed_pawn"]
+
+
+def get_weights():  # Every tunable value by the name it has in a weights file
+    return {"piece_values": PIECE_VALUES, "phase_weights": PHASE_WEIGHTS, "midgame_tables": MIDGAME_TABLES,
+            "endgame_tables": ENDGAME_TABLES, "mobility_weights": MOBILITY_WEIGHTS, "doubled_pawn": DOUBLED_PAWN,
+            "isolated_pawn": ISOLATED_PAWN, "passed_pawn": PASSED_PAWN}
+
+
+def set_weights(weights):  # Replaces the values named in weights and leaves the others as they are
+    global PIECE_VALUES, PHASE_WEIGHTS, MIDGAME_TABLES, ENDGAME_TABLES, MOBILITY_WEIGHTS, DOUBLED_PAWN, \
+        ISOLATED_PAWN, PASSED_PAWN, MIDGAME_VALUES, ENDGAME_VALUES
+    unknown = set(weights) - set(WEIGHT_NAMES)
+    if unknown:
+        raise ValueError("unknown weights: " + ", ".join(sorted(unknown)))
+    values = dict(get_weights(), **weights)
+    PIECE_VALUES = values["piece_values"]
+    PHASE_WEIGHTS = values["phase_weights"]
+    MIDGAME_TABLES = values["midgame_tables"]
+    ENDGAME_TABLES = values["endgame_tables"]
+    MOBILITY_WEIGHTS = values["mobility_weights"]
+    DOUBLED_PAWN = values["doubled_pawn"]
+    ISOLATED_PAWN = values["isolated_pawn"]
+    PASSED_PAWN = values["passed_pawn"]
+    MIDGAME_VALUES = _signed_tables(MIDGAME_TABLES)
+    ENDGAME_VALUES = _signed_tables(ENDGAME_TABLES)
+    _pawn_cache.clear()
+
+
+def load_weights(path):  # Reads a JSON weights file, as written by save_weights, and uses it from then on
+    with open(path) as weights_file:
+        set_weights(json.load(weights_file))
+
+
+def save_weights(path):
+    with open(path, "w") as weights_file:
+        json.dump(get_weights(), weights_file, indent=1)
+
+
+def pawn_structure(white_pawns, black_pawns):  # Doubled, isolated and passed pawns, white's score minus black's
+    key = (white_pawns, black_pawns)
+    score = _pawn_cache.get(key)
+    if score is not None:
+        return score
+    score = 0
+    for colour, pawns, enemy_pawns, sign in ((WHITE, white_pawns, black_pawns, 1),
+                                             (BLACK, black_pawns, white_pawns, -1)):
+        for f in range(8):
+            count = (pawns & FILE_MASKS[f]).bit_count()
+            if count:
+                if count > 1:
+                    score += sign * DOUBLED_PAWN * (count - 1)
+                if not pawns & ADJACENT_FILES[f]:
+                    score += sign * ISOLATED_PAWN * count
+        passed_masks = PASSED_MASKS[colour]
+        for sq in squares(pawns):
+            if not enemy_pawns & passed_masks[sq]:
+                score += sign * PASSED_PAWN[7 - sq // 8 if colour == WHITE else sq // 8]
+    if len(_pawn_cache) >= PAWN_CACHE_LIMIT:
+        _pawn_cache.clear()
+    _pawn_cache[key] = score
+    return score
+
+
+def mobility(position):  # Weighted count of the squares each knight, bishop, rook and queen attacks, white minus black
+    pieces = position.pieces
+    own_pieces = position.occupied
+    occupied = own_pieces[WHITE] | own_pieces[BLACK]
+    score = 0
+    for colour, sign in ((WHITE, 1), (BLACK, -1)):
+        not_own = FULL ^ own_pieces[colour]
+        base = colour * 6
+        for piece_type in (KNIGHT, BISHOP, ROOK, QUEEN):
+            weight = MOBILITY_WEIGHTS[piece_type]
+            if not weight:
+                continue
+            count = 0
+            for sq in squares(pieces[base + piece_type]):
+                if piece_type == KNIGHT:
+                    attacks = KNIGHT_ATTACKS[sq]
+                else:
+                    attacks = 0
+                    if piece_type != ROOK:
+                        attacks = BISHOP_TABLES[sq][occupied & BISHOP_MASKS[sq]]
+                    if piece_type != BISHOP:
+                        attacks |= ROOK_TABLES[sq][occupied & ROOK_MASKS[sq]]
+                count += (attacks & not_own).bit_count()
+            score += sign * weight * count
+    return score
+
+
+def evaluate(position):  # Score in centipawns from the side to move's point of view
+    # Material and piece-square tables tapered from the middlegame to the endgame, then mobility and pawn structure
+    midgame = endgame = phase = 0
+    pieces = position.pieces
+    for piece in range(12):
+        bb = pieces[piece]
+        if not bb:
+            continue
+        midgame_values = MIDGAME_VALUES[piece]
+        endgame_values = ENDGAME_VALUES[piece]
+        phase += PHASE_WEIGHTS[piece % 6] * bb.bit_count()
+        while bb:
+            low = bb & -bb
+            sq = low.bit_length() - 1
+            midgame += midgame_values[sq]
+            endgame += endgame_values[sq]
+            bb ^= low
+    phase = min(phase, MAX_PHASE)  # Tapers from the middlegame king table to the endgame one as pieces come off
+    score = int((midgame * phase + endgame * (MAX_PHASE - phase)) / MAX_PHASE) + mobility(position) \
+        + pawn_structure(pieces[PAWN], pieces[6 + PAWN])
+    return score if position.side == WHITE else -score
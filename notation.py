@@ -0,0 +1,143 @@
+import datetime
+import re
+
+from bitboard import EMPTY, PAWN, KING, STARTING_FEN, MOVE_END_SHIFT, decode_move, square_name
+
+PIECE_LETTERS = "PNBRQK"  # By piece type
+PGN_LINE_LENGTH = 80
+# The seven tag roster every PGN game starts with, in this order
+PGN_TAGS = ["Event", "Site", "Date", "Round", "White", "Black", "Result"]
+PGN_RESULTS = ["1-0", "0-1", "1/2-1/2", "*"]
+# Movetext tokens: a comment in braces, a comment to the end of the line, a variation bracket or anything else
+PGN_TOKEN = re.compile(r"\{[^}]*\}|;[^\n]*|[()]|[^\s(){};]+")
+
+
+def move_to_san(position, move, moves=None):
+    # Standard algebraic notation such as 'Nbd7', 'exd6', 'e8=Q+' or 'O-O-O#' for a legal move of position. moves
+    # are the legal moves of position, when they have already been generated
+    san = _san_body(position, move, moves)
+    position.make_move(move)
+    if position.in_check():
+        san += "#" if not position.generate_moves() else "+"
+    position.unmake_move()
+    return san
+
+
+def _san_body(position, move, moves):  # The SAN of the move without the check or mate sign
+    start, end, promotion = decode_move(move)
+    mailbox = position.mailbox
+    piece = mailbox[start]
+    piece_type = piece % 6
+    if piece_type == KING and abs(end - start) == 2:
+        san = "O-O" if end > start else "O-O-O"
+    elif piece_type == PAWN:
+        san = square_name(end)
+        if start % 8 != end % 8:  # Pawns only change file by capturing, en passant included
+            san = square_name(start)[0] + "x" + san
+        if promotion:
+            san += "=" + PIECE_LETTERS[promotion]
+    else:
+        if moves is None:
+            moves = position.generate_moves()
+        # Other pieces of the same kind that can go to the same square make the start file, rank or both necessary
+        rivals = [other & 63 for other in moves
+                  if other != move and other >> MOVE_END_SHIFT & 63 == end and mailbox[other & 63] == piece]
+        disambiguation = ""
+        if rivals:
+            if all(rival % 8 != start % 8 for rival in rivals):
+                disambiguation = square_name(start)[0]
+            elif all(rival // 8 != start // 8 for rival in rivals):
+                disambiguation = square_name(start)[1]
+            else:
+                disambiguation = square_name(start)
+        san = PIECE_LETTERS[piece_type] + disambiguation + ("x" if mailbox[end] != EMPTY else "") + square_name(end)
+    return san
+
+
+def parse_san(position, san):
+    # The packed legal move of position written as san. Check signs, annotations such as '!?' and castling with
+    # zeros are accepted. Raises ValueError when no legal move matches
+    body = san.rstrip("+#!?").replace("0", "O")
+    moves = position.generate_moves()
+    for move in moves:
+        if _san_body(position, move, moves) == body:
+            return move
+    raise ValueError("illegal move {} in {}".format(san, position.fen()))
+
+
+def read_pgn(pgn_file):
+    # Yields (tags, SAN moves, result) for every game of an open PGN file. Comments, variations, move numbers and
+    # numeric annotation glyphs are skipped
+    tags, movetext = {}, []
+    for line in pgn_file:
+        line = line.strip()
+        if line.startswith("[") and line.endswith("]"):
+            if movetext:  # The tags of the next game
+                yield _parse_game(tags, movetext)
+                tags, movetext = {}, []
+            name, _, value = line[1:-1].partition(" ")
+            tags[name] = value.strip().strip('"')
+        elif line and not line.startswith("%"):
+            movetext.append(line)
+    if movetext:
+        yield _parse_game(tags, movetext)
+
+
+def _parse_game(tags, movetext):
+    sans = []
+    result = tags.get("Result", "*")
+    variation_depth = 0
+    for token in PGN_TOKEN.findall("\n".join(movetext)):
+        if token == "(":
+            variation_depth += 1
+        elif token == ")":
+            variation_depth -= 1
+        elif variation_depth or token[0] in "{;$":
+            continue
+        elif token in PGN_RESULTS:
+            result = token
+        else:
+            if token[0].isdigit() and "." in token:  # A move number, maybe with the move written against it
+                token = token[token.rindex(".") + 1:]
+            if token:
+                sans.append(token)
+    return tags, sans, result
+
+
+def pgn_game(tags, sans, result, fen=None):
+    # One game as PGN text: the seven tag roster first, then the other tags, then the movetext wrapped at 80
+    # characters. fen is the starting position when it isn't the usual one
+    tags = dict(tags, Result=result)
+    tags.setdefault("Date", datetime.date.today().strftime("%Y.%m.%d"))
+    if fen is not None and fen != STARTING_FEN:
+        tags["SetUp"] = "1"
+        tags["FEN"] = fen
+    lines = ['[{} "{}"]'.format(name, str(tags.get(name, "?")).replace('"', "'")) for name in PGN_TAGS]
+    lines += ['[{} "{}"]'.format(name, str(value).replace('"', "'")) for name, value in tags.items()
+              if name not in PGN_TAGS]
+    lines.append("")
+
+    fields = (fen or STARTING_FEN).split()
+    white_to_move = len(fields) < 2 or fields[1] == "w"
+    move_number = int(fields[5]) if len(fields) > 5 else 1
+    tokens = []
+    for san in sans:
+        if white_to_move:
+            tokens.append("{}.".format(move_number))
+        elif not tokens:
+            tokens.append("{}...".format(move_number))  # The game starts with black's move
+        tokens.append(san)
+        if not white_to_move:
+            move_number += 1
+        white_to_move = not white_to_move
+    tokens.append(result)
+
+    line = ""
+    for token in tokens:
+        if line and len(line) + 1 + len(token) > PGN_LINE_LENGTH:
+            lines.append(line)
+            line = token
+        else:
+            line = line + " " + token if line else token
+    lines.append(line)
+    return "\n".join(lines) + "\n\n"
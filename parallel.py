@@ -0,0 +1,151 @@
+import argparse
+import multiprocessing
+import time
+from multiprocessing import shared_memory
+
+from bitboard import move_to_uci
+from chess_engine import GameState
+from search import Searcher, SearchResult, wrap_pv, print_iteration
+from transposition import TranspositionTable, table_bytes
+
+
+def _summary(result):  # The picklable part of a SearchResult, the moves as packed ints
+    return ([move.move for move in result.pv], result.score, result.depth, result.nodes, result.seconds,
+            result.hash_hit_rate)
+
+
+def _worker(index, memory_name, hash_mb, tasks, results, stop_event):
+    # Runs searches from its task queue until it gets None. Every worker has its own Searcher, so killers and
+    # history stay per process, but they all read and write the one transposition table in shared memory
+    memory = shared_memory.SharedMemory(name=memory_name)
+    searcher = Searcher(table=TranspositionTable(hash_mb, memory.buf))
+    searcher.helper_index = index
+    searcher.stop_event = stop_event
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        search_id, fen, moves, time_limit, depth = task
+        game_state = GameState(fen)
+        for move in moves:  # Replayed so the repetition history is the same as in the caller's game
+            game_state.position.make_move(move)
+
+        def on_iteration(result):
+            results.put((search_id, index, False, _summary(result)))
+
+        result = searcher.search(game_state, time_limit=time_limit, depth=depth, on_iteration=on_iteration)
+        results.put((search_id, index, True, _summary(result)))
+    searcher.table.table.release()  # The shared memory can't be closed while a view of it is still open
+    memory.close()
+
+
+class ParallelSearcher:
+    # Lazy SMP: every worker process searches the same root position and they only cooperate through the shared
+    # transposition table. Helpers skip alternate depths, so one worker's results are often already in the table when
+    # another gets there. The first worker to finish gives the result and the others are stopped.
+    # Processes rather than threads, since pure Python search holds the GIL
+    def __init__(self, workers=None, hash_mb=16):
+        self.workers = workers or multiprocessing.cpu_count()
+        size = table_bytes(hash_mb)
+        self.memory = shared_memory.SharedMemory(create=True, size=size)
+        self.memory.buf[:size] = bytes(size)
+        self.stop_event = multiprocessing.Event()
+        self.results = multiprocessing.Queue()
+        self.task_queues = [multiprocessing.Queue() for _ in range(self.workers)]
+        self.processes = [multiprocessing.Process(target=_worker, daemon=True,
+                                                  args=(index, self.memory.name, hash_mb, self.task_queues[index],
+                                                        self.results, self.stop_event))
+                          for index in range(self.workers)]
+        for process in self.processes:
+            process.start()
+        self.search_id = 0
+
+    def search(self, game_state, time_limit=None, depth=None, on_iteration=None):
+        # The same interface as Searcher.search. on_iteration is called whenever any worker finishes an iteration
+        # deeper than every one reported so far
+        position = game_state.position
+        root = position.copy()
+        moves = root.moves_played()
+        while root.ply:
+            root.unmake_move()
+        self.search_id += 1
+        self.stop_event.clear()
+        start_time = time.perf_counter()
+        for tasks in self.task_queues:
+            tasks.put((self.search_id, root.fen(), moves, time_limit, depth))
+
+        first = None
+        nodes = 0
+        reported_depth = 0
+        finished = 0
+        while finished < self.workers:
+            search_id, index, done, summary = self.results.get()
+            if search_id != self.search_id:
+                continue  # Left over from a search that was abandoned
+            if done:
+                finished += 1
+                nodes += summary[3]
+                if first is None:
+                    first = summary
+                    self.stop_event.set()
+            elif first is None and on_iteration is not None and summary[2] > reported_depth:
+                reported_depth = summary[2]
+                on_iteration(self._result(position, summary, time.perf_counter() - start_time))
+
+        result = self._result(position, first, time.perf_counter() - start_time)
+        result.nodes = nodes  # Counted over every worker
+        return result
+
+    @staticmethod
+    def _result(position, summary, seconds):
+        pv, score, depth, nodes, _, hash_hit_rate = summary
+        pv = wrap_pv(position, pv)
+        return SearchResult(pv[0] if pv else None, pv, score, depth, nodes, seconds, hash_hit_rate)
+
+    def close(self):
+        for tasks in self.task_queues:
+            tasks.put(None)
+        for process in self.processes:
+            process.join()
+        self.memory.close()
+        self.memory.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Search a position with several processes sharing one hash table")
+    parser.add_argument("--fen", help="the position to search (default: the starting position)")
+    parser.add_argument("--time", type=float, help="the time budget in seconds")
+    parser.add_argument("--depth", type=int, help="the depth to search to")
+    parser.add_argument("--workers", type=int, default=multiprocessing.cpu_count(),
+                        help="the number of worker processes (default: one per core)")
+    parser.add_argument("--hash", type=int, default=16, help="the transposition table size in MB")
+    parser.add_argument("--compare", action="store_true",
+                        help="search to the same depth in a single process first and report the speedup")
+    args = parser.parse_args()
+
+    if args.compare:
+        depth = args.depth or 6
+        single = Searcher(args.hash).search(GameState(args.fen), depth=depth)
+        print("1 process:   depth {} in {:.2f}s, {} nodes".format(single.depth, single.seconds, single.nodes))
+        with ParallelSearcher(args.workers, args.hash) as searcher:
+            result = searcher.search(GameState(args.fen), depth=depth)
+        print("{} processes: depth {} in {:.2f}s, {} nodes".format(args.workers, result.depth, result.seconds,
+                                                                   result.nodes))
+        print("time to depth speedup {:.2f}x".format(single.seconds / result.seconds if result.seconds else 0))
+        return
+
+    with ParallelSearcher(args.workers, args.hash) as searcher:
+        result = searcher.search(GameState(args.fen), time_limit=args.time, depth=args.depth,
+                                 on_iteration=print_iteration)
+    if result.best_move is not None:
+        print("bestmove {}".format(move_to_uci(result.best_move.move)))
+
+
+if __name__ == "__main__":
+    main()
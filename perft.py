@@ -0,0 +1,141 @@
+import argparse
+import csv
+import datetime
+import os
+import subprocess
+import time
+
+from bitboard import STARTING_FEN, move_to_uci
+from chess_engine import GameState
+
+# (name, FEN, {depth: known leaf count}, depth the suite runs it to)
+TEST_POSITIONS = [
+    ("startpos", STARTING_FEN, {1: 20, 2: 400, 3: 8902, 4: 197281, 5: 4865609}, 4),
+    ("kiwipete", "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+     {1: 48, 2: 2039, 3: 97862, 4: 4085603}, 3),
+    ("position3", "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1", {1: 14, 2: 191, 3: 2812, 4: 43238, 5: 674624}, 4),
+    ("position4", "r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1",
+     {1: 6, 2: 264, 3: 9467, 4: 422333}, 3),
+    ("position5", "rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8",
+     {1: 44, 2: 1486, 3: 62379, 4: 2103487}, 3),
+    ("position6", "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+     {1: 46, 2: 2079, 3: 89890, 4: 3894594}, 3),
+    # Edge cases for en passant, castling and promotion
+    ("illegal_ep_1", "3k4/3p4/8/K1P4r/8/8/8/8 b - - 0 1", {1: 18, 2: 92, 3: 1670, 4: 10138}, 4),
+    ("illegal_ep_2", "8/8/4k3/8/2p5/8/B2P2K1/8 w - - 0 1", {1: 13, 2: 102, 3: 1266, 4: 10276}, 4),
+    ("ep_gives_check", "8/8/1k6/2b5/2pP4/8/5K2/8 b - d3 0 1", {1: 15, 2: 126, 3: 1928, 4: 13931}, 4),
+    ("short_castle_check", "5k2/8/8/8/8/8/8/4K2R w K - 0 1", {1: 15, 2: 66, 3: 1198, 4: 6399}, 4),
+    ("long_castle_check", "3k4/8/8/8/8/8/8/R3K3 w Q - 0 1", {1: 16, 2: 71, 3: 1286, 4: 7418}, 4),
+    ("castle_rights", "r3k2r/1b4bq/8/8/8/8/7B/R3K2R w KQkq - 0 1", {1: 26, 2: 1141, 3: 27826, 4: 1274206}, 3),
+    ("castle_prevented", "r3k2r/8/3Q4/8/8/5q2/8/R3K2R b KQkq - 0 1", {1: 44, 2: 1494, 3: 50509, 4: 1720476}, 3),
+    ("promote_out_of_check", "2K2r2/4P3/8/8/8/8/8/3k4 w - - 0 1", {1: 11, 2: 133, 3: 1442, 4: 19174}, 4),
+    ("discovered_check", "8/8/1P2K3/8/2n5/1q6/8/5k2 b - - 0 1", {1: 29, 2: 165, 3: 5160, 4: 31961}, 4),
+    ("promote_to_check", "4k3/1P6/8/8/8/8/K7/8 w - - 0 1", {1: 9, 2: 40, 3: 472, 4: 2661}, 4),
+    ("underpromote_to_check", "8/P1k5/K7/8/8/8/8/8 w - - 0 1", {1: 6, 2: 27, 3: 273, 4: 1329}, 4),
+    ("self_stalemate", "K1k5/8/P7/8/8/8/8/8 w - - 0 1", {1: 2, 2: 6, 3: 13, 4: 63}, 4),
+    ("stalemate_checkmate", "8/k1P5/8/1K6/8/8/8/8 w - - 0 1", {1: 10, 2: 25, 3: 268, 4: 926}, 4),
+    ("knight_queen_fork", "8/8/2k5/5q2/5n2/8/5K2/8 b - - 0 1", {1: 37, 2: 183, 3: 6559, 4: 23527}, 4),
+]
+
+HISTORY_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "perft_history.csv")
+HISTORY_FIELDS = ["date", "commit", "position", "depth", "nodes", "expected", "passed", "seconds", "nodes_per_second"]
+
+
+def perft(position, depth):  # The number of leaf nodes of the legal move tree to the given depth
+    if depth == 0:
+        return 1
+    moves = position.generate_moves()
+    if depth == 1:
+        return len(moves)  # Every generated move is legal, so the last level is just counted
+    nodes = 0
+    for move in moves:
+        position.make_move(move)
+        nodes += perft(position, depth - 1)
+        position.unmake_move()
+    return nodes
+
+
+def divide(position, depth):  # The perft count below each root move, as a list of (move, nodes)
+    counts = []
+    for move in position.generate_moves():
+        position.make_move(move)
+        counts.append((move_to_uci(move), perft(position, depth - 1)))
+        position.unmake_move()
+    return sorted(counts)
+
+
+def run_perft(name, fen, depth, expected=None, show_divide=False):
+    position = GameState(fen).position
+    start_time = time.perf_counter()
+    if show_divide:
+        counts = divide(position, depth)
+        nodes = sum(count for _, count in counts)
+    else:
+        counts = []
+        nodes = perft(position, depth)
+    seconds = time.perf_counter() - start_time
+
+    for move, count in counts:
+        print("    {:<6} {}".format(move, count))
+    passed = "" if expected is None else nodes == expected
+    nodes_per_second = round(nodes / seconds) if seconds else 0
+    status = {"": "--", True: "OK", False: "FAIL (expected {})".format(expected)}[passed]
+    print("{:<22} depth {}  {:>10} nodes  {:>8.2f}s  {:>10} nps  {}".format(name, depth, nodes, seconds,
+                                                                           nodes_per_second, status))
+    return {"position": name, "depth": depth, "nodes": nodes, "expected": "" if expected is None else expected,
+            "passed": passed, "seconds": round(seconds, 4), "nodes_per_second": nodes_per_second}
+
+
+def record_history(results, path=HISTORY_FILE):  # Appends the results so throughput can be compared across commits
+    # The commit is marked '-dirty' when the measured code has uncommitted changes, so the numbers are never put
+    # down to a commit that doesn't contain that code
+    try:
+        commit = subprocess.run(["git", "describe", "--always", "--dirty"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = ""
+    date = datetime.datetime.now().isoformat(timespec="seconds")
+    new_file = not os.path.exists(path)
+    with open(path, "a", newline="") as history:
+        writer = csv.DictWriter(history, fieldnames=HISTORY_FIELDS)
+        if new_file:
+            writer.writeheader()
+        for result in results:
+            writer.writerow(dict(result, date=date, commit=commit))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Count the leaf nodes of the move tree and measure nodes/sec")
+    parser.add_argument("--fen", help="the position to count from (default: the starting position)")
+    parser.add_argument("--position", choices=[name for name, _, _, _ in TEST_POSITIONS], help="a named test position")
+    parser.add_argument("--depth", type=int, help="the depth to count to")
+    parser.add_argument("--divide", action="store_true", help="show the count below each root move")
+    parser.add_argument("--suite", action="store_true", help="check every test position against its known count")
+    parser.add_argument("--record", action="store_true", help="append the results to " + HISTORY_FILE)
+    args = parser.parse_args()
+
+    results = []
+    if args.suite:
+        for name, fen, known, suite_depth in TEST_POSITIONS:
+            depth = args.depth or suite_depth
+            results.append(run_perft(name, fen, depth, known.get(depth), args.divide))
+    else:
+        name, fen, known = "fen", args.fen, {}
+        for test_name, test_fen, test_known, _ in TEST_POSITIONS:
+            if test_name == (args.position or "startpos") and not args.fen:
+                name, fen, known = test_name, test_fen, test_known
+        depth = args.depth or 4
+        results.append(run_perft(name, fen, depth, known.get(depth), args.divide))
+
+    total_nodes = sum(result["nodes"] for result in results)
+    total_seconds = sum(result["seconds"] for result in results)
+    print("total {} nodes in {:.2f}s, {} nps".format(total_nodes, total_seconds,
+                                                    round(total_nodes / total_seconds) if total_seconds else 0))
+    if args.record:
+        record_history(results)
+    if any(result["passed"] is False for result in results):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
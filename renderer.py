@@ -0,0 +1,120 @@
+import pygame
+
+from bitboard import PIECE_NAMES
+
+STATUS_CACHE_LIMIT = 64  # Rendered status texts kept before the cache is cleared
+
+
+class Renderer:
+    # Draws the board, pieces, highlights, promotion choices and status bar, but only where something changed since the
+    # last frame. The board squares are pre-rendered once into a background surface and every piece image is loaded and
+    # scaled once into a single sprite atlas
+    def __init__(self, screen, square_size, square_colours, highlight_colour, promotions, promotion_font, status_font,
+                 bar_height, images_path="Images/"):
+        self.screen = screen
+        self.square_size = square_size
+        self.board_size = square_size * 8
+        self.promotions = promotions  # The promotion piece letters, in the order they are shown
+        self.status_font = status_font
+        self.bar_rect = pygame.Rect(0, self.board_size + 1, self.board_size, bar_height)
+
+        self.background = pygame.Surface((self.board_size, self.board_size)).convert()
+        for r in range(8):
+            for c in range(8):
+                self.background.fill(square_colours[(r + c) % 2], self.square_rect(r, c))
+        self.highlight = pygame.Surface((square_size, square_size)).convert()
+        self.highlight.fill(highlight_colour)
+        self.highlight.set_alpha(100)
+        self.overlay = pygame.Surface((self.board_size, self.board_size)).convert()  # Dims the board for a promotion
+        self.overlay.fill((0, 0, 0))
+        self.overlay.set_alpha(100)
+        self.promotion_text = promotion_font.render("To which piece would you like to promote the pawn?", True,
+                                                    (255, 255, 255))
+        self.sprites = self._load_sprites(images_path)
+        self.status_texts = {}  # Rendered status bar texts by their text, the same few come back all the time
+
+        # What is on the screen now, compared with the next frame to find the squares that need drawing again
+        self.drawn_pieces = None
+        self.drawn_highlights = set()
+        self.drawn_promotion = None
+        self.drawn_status = None
+
+    def _load_sprites(self, images_path):  # Each piece image scaled once into one atlas, handed out as subsurfaces
+        size = self.square_size
+        atlas = pygame.Surface((size * len(PIECE_NAMES), size), pygame.SRCALPHA)
+        for index, piece in enumerate(PIECE_NAMES):
+            image = pygame.image.load(images_path + piece + ".png")
+            atlas.blit(pygame.transform.scale(image, (size, size)), (index * size, 0))
+        atlas = atlas.convert_alpha()
+        return {piece: atlas.subsurface(pygame.Rect(index * size, 0, size, size))
+                for index, piece in enumerate(PIECE_NAMES)}
+
+    def square_rect(self, r, c):
+        return pygame.Rect(c * self.square_size, r * self.square_size, self.square_size, self.square_size)
+
+    def invalidate(self):  # Draws everything on the next frame, for when the window contents were lost
+        self.drawn_pieces = None
+        self.drawn_promotion = None
+        self.drawn_status = None
+
+    def draw(self, board, highlighted_squares, pawn_promotion, status):
+        # board is read as board[row][column] == 'wP' / '--' and pawn_promotion is the (row, column) of a pawn waiting
+        # for a promotion choice, or (). Returns whether anything was drawn
+        pieces = [piece for row in board for piece in row]
+        highlights = set(highlighted_squares)
+        dirty = []
+        if self.drawn_pieces is None or pawn_promotion != self.drawn_promotion:
+            self._draw_full_board(pieces, highlights, pawn_promotion)
+            dirty.append(pygame.Rect(0, 0, self.board_size, self.board_size))
+        elif pawn_promotion == ():
+            for sq in range(64):
+                square = divmod(sq, 8)
+                if pieces[sq] != self.drawn_pieces[sq] \
+                        or (square in highlights) != (square in self.drawn_highlights):
+                    dirty.append(self._draw_square(square[0], square[1], pieces[sq], square in highlights))
+        self.drawn_pieces = pieces
+        self.drawn_highlights = highlights
+        self.drawn_promotion = pawn_promotion
+
+        if status != self.drawn_status:  # One line of the status bar for each line of status
+            self.screen.fill((255, 255, 255), self.bar_rect)
+            texts = self.status_texts.get(status)
+            if texts is None:
+                if len(self.status_texts) >= STATUS_CACHE_LIMIT:
+                    self.status_texts.clear()
+                texts = self.status_texts[status] = [self.status_font.render(line, True, (0, 0, 0), (255, 255, 255))
+                                                     for line in status.split("\n")]
+            for i, text in enumerate(texts):
+                self.screen.blit(text, (5, self.bar_rect.top + 4 + i * self.status_font.get_linesize()))
+            self.drawn_status = status
+            dirty.append(self.bar_rect)
+
+        if dirty:
+            pygame.display.update(dirty)
+        return bool(dirty)
+
+    def _draw_square(self, r, c, piece, highlighted):
+        rect = self.square_rect(r, c)
+        self.screen.blit(self.background, rect, rect)
+        if highlighted:
+            self.screen.blit(self.highlight, rect)
+        if piece != "--":
+            self.screen.blit(self.sprites[piece], rect)
+        return rect
+
+    def _draw_full_board(self, pieces, highlights, pawn_promotion):
+        self.screen.blit(self.background, (0, 0))
+        for r, c in highlights:
+            self.screen.blit(self.highlight, self.square_rect(r, c))
+        if pawn_promotion == ():
+            for sq, piece in enumerate(pieces):
+                if piece != "--":
+                    self.screen.blit(self.sprites[piece], self.square_rect(sq // 8, sq % 8))
+            return
+
+        self.screen.blit(self.overlay, (0, 0))  # The semi-transparent black square overlay
+        pawn_colour = pieces[pawn_promotion[0] * 8 + pawn_promotion[1]][0]
+        for i, promotion in enumerate(self.promotions):
+            # The co-ordinates for arranging the piece promotion choices in the middle
+            self.screen.blit(self.sprites[pawn_colour + promotion], self.square_rect(4, 4 + i - 2))
+        self.screen.blit(self.promotion_text, (self.board_size // 2 - round(self.square_size * 3.5), self.square_size))
@@ -0,0 +1,485 @@
+import argparse
+import time
+
+from bitboard import EMPTY, NO_MOVE, MOVE_END_SHIFT, MOVE_PROMOTION_SHIFT, TACTICAL_MOVES, QUIET_MOVES, move_to_uci
+from chess_engine import GameState, Move
+from evaluation import evaluate, load_weights
+from instrumentation import Instrumentation, CUTOFF_SLOTS, POSITION_TIMERS, SEARCHER_TIMERS
+from transposition import TranspositionTable, EXACT, LOWER_BOUND, UPPER_BOUND
+
+INFINITY = 1000000
+MATE_SCORE = 100000  # Mate in n plies from the root scores MATE_SCORE - n
+MATE_BOUND = MATE_SCORE - 1000  # Scores beyond this are mates
+MAX_PLY = 100
+TIME_CHECK_MASK = 255  # The clock is read once every 256 nodes
+
+ASPIRATION_WINDOW = 40  # Half width of the first window around the previous iteration's score
+ASPIRATION_MIN_DEPTH = 4  # Shallower iterations are cheap enough to search with a full window
+SOFT_TIME_FRACTION = 0.5  # No new iteration starts after this share of the budget, it would not finish
+
+# Move ordering: the previous best or hash move, then captures by MVV-LVA, promotions, killers and finally quiet moves
+# by history. Captures of a defended piece worth less than the capturing one are put off until after the quiet moves
+PV_MOVE_SCORE = 1 << 30
+CAPTURE_SCORE = 1 << 28
+PROMOTION_SCORE = 1 << 27
+KILLER_SCORE = 1 << 26
+HISTORY_LIMIT = 1 << 25  # History scores are halved once one passes this, so they stay below the killers
+EXCHANGE_VALUES = [1, 3, 3, 5, 9, 100]  # By piece type, to tell losing captures from winning ones
+BATCH_MIN_LEAVES = 16  # Fewer leaves cost more in NumPy call overhead than one batch saves
+
+
+class SearchResult:
+    def __init__(self, best_move, pv, score, depth, nodes, seconds, hash_hit_rate=0.0):
+        self.best_move = best_move  # A Move, or None when the side to move has no legal moves
+        self.pv = pv  # The principal variation as a list of Move objects, starting with best_move
+        self.score = score  # Centipawns from the side to move's point of view
+        self.depth = depth  # The deepest iteration that finished
+        self.nodes = nodes
+        self.seconds = seconds
+        self.hash_hit_rate = hash_hit_rate  # The share of transposition table probes that found their position
+
+
+def score_to_table(score, ply):  # Mate scores are stored as distance from the node, not from the root
+    if score >= MATE_BOUND:
+        return score + ply
+    if score <= -MATE_BOUND:
+        return score - ply
+    return score
+
+
+def score_from_table(score, ply):
+    if score >= MATE_BOUND:
+        return score - ply
+    if score <= -MATE_BOUND:
+        return score + ply
+    return score
+
+
+class Searcher:  # Negamax alpha-beta with iterative deepening, aspiration windows and quiescence search
+    def __init__(self, hash_mb=16, table=None, batch_evaluator=None, tablebases=None, instrumentation=None):
+        self.table = table if table is not None else TranspositionTable(hash_mb)  # Kept between searches
+        # With a batch_evaluation.BatchEvaluator, the children of the last full-width ply and of quiescence nodes are
+        # all evaluated in one call before they are searched
+        self.batch_evaluator = batch_evaluator
+        self.leaf_scores = {}  # Key -> static evaluation, from the latest batch
+        self.tablebases = tablebases  # A tablebase.Tablebases probed at the root and instead of searching below it
+        # An instrumentation.Instrumentation that gets the counters of every search and times its phases
+        self.instrumentation = instrumentation
+        self.killers = [[NO_MOVE, NO_MOVE] for _ in range(MAX_PLY + 1)]  # Two quiet moves per ply that caused a cutoff
+        self.history = [[0] * 64 for _ in range(12)]  # Quiet cutoff scores indexed by piece and end square
+        self.pv_table = [[] for _ in range(MAX_PLY + 2)]  # The best line found below each ply
+        self.move_buffers = [[] for _ in range(MAX_PLY + 2)]  # Reused by the move generator at each ply
+        self.quiet_buffers = [[] for _ in range(MAX_PLY + 2)]  # The same for the quiet moves stage
+        self.previous_pv = []
+        self.nodes = 0  # Quiescence nodes included
+        self.quiescence_nodes = 0
+        self.generated_moves = 0
+        self.searched_moves = 0
+        self.cutoffs = [0] * CUTOFF_SLOTS  # Beta cutoffs by the index of the move that caused them
+        self.start_time = 0.0
+        self.time_limit = None
+        self.completed_depth = 0
+        self.deadline = None
+        self.stopped = False
+        self.stop_event = None  # Anything with is_set(), such as a multiprocessing.Event, that stops the search early
+        self.helper_index = 0  # Lazy SMP helpers skip every other depth, so the workers spread over different depths
+
+    def search(self, game_state, time_limit=None, depth=None, on_iteration=None):
+        # Searches until depth is reached or time_limit seconds have passed, whichever comes first. on_iteration is
+        # called with each finished iteration's SearchResult
+        instrumentation = self.instrumentation
+        if instrumentation is None:
+            return self._search(game_state, time_limit, depth, on_iteration)
+        position = game_state.position
+        instrumentation.instrument(position, POSITION_TIMERS)
+        instrumentation.instrument(self, SEARCHER_TIMERS)
+        probes, hits = self.table.probes, self.table.hits
+        try:
+            return self._search(game_state, time_limit, depth, on_iteration)
+        finally:
+            instrumentation.release(position, POSITION_TIMERS)
+            instrumentation.release(self, SEARCHER_TIMERS)
+            instrumentation.add(searches=1, nodes=self.nodes, quiescence_nodes=self.quiescence_nodes,
+                                hash_probes=self.table.probes - probes, hash_hits=self.table.hits - hits,
+                                generated_moves=self.generated_moves, searched_moves=self.searched_moves,
+                                cutoffs=self.cutoffs)
+
+    def _search(self, game_state, time_limit, depth, on_iteration):
+        position = game_state.position
+        start_time = self.start_time = time.perf_counter()
+        max_depth = min(depth or MAX_PLY, MAX_PLY)
+        if time_limit is None and depth is None:
+            max_depth = 4
+        self.time_limit = time_limit
+        self.completed_depth = 0
+        self.nodes = self.quiescence_nodes = self.generated_moves = self.searched_moves = 0
+        self.cutoffs = [0] * CUTOFF_SLOTS
+        self.stopped = False
+        self.deadline = None  # The first iteration always finishes so there is a move to return
+        self.previous_pv = []
+        self.table.new_search()
+        probes, hits = self.table.probes, self.table.hits
+        for killers in self.killers:
+            killers[0] = killers[1] = NO_MOVE
+        for piece_history in self.history:
+            for sq in range(64):
+                piece_history[sq] >>= 1  # Ages the history of earlier searches
+
+        result = SearchResult(None, [], 0, 0, 0, 0.0)
+        if not position.generate_moves():
+            result.score = -MATE_SCORE if position.in_check() else 0
+            return result
+        if self.tablebases is not None:
+            move, score = self.tablebases.best_move(position)
+            if move != NO_MOVE:  # The tables already know the fastest mate, nothing needs searching
+                result = SearchResult(None, wrap_pv(position, [move]), score, 0, 0, time.perf_counter() - start_time)
+                result.best_move = result.pv[0]
+                if on_iteration is not None:
+                    on_iteration(result)
+                return result
+
+        score = 0
+        for current_depth in range(1, max_depth + 1):
+            if self.helper_index and current_depth < max_depth and (current_depth + self.helper_index) % 2:
+                continue
+            score = self._aspiration_search(position, current_depth, score)
+            if self.stopped:
+                break
+            self.previous_pv = self.pv_table[0]
+            seconds = time.perf_counter() - start_time
+            result = SearchResult(None, wrap_pv(position, self.previous_pv), score, current_depth, self.nodes,
+                                  seconds)
+            result.best_move = result.pv[0]
+            self.completed_depth = current_depth
+            if on_iteration is not None:
+                on_iteration(result)
+            if abs(score) >= MATE_BOUND and MATE_SCORE - abs(score) <= current_depth:
+                break  # A mate that this depth can see completely won't change with more depth
+            time_limit = self.time_limit  # Read again every iteration, set_time_limit can change it from another thread
+            if time_limit is not None:
+                if seconds >= time_limit * SOFT_TIME_FRACTION:
+                    break
+                self.deadline = start_time + time_limit
+        result.nodes = self.nodes
+        result.seconds = time.perf_counter() - start_time
+        if self.table.probes > probes:
+            result.hash_hit_rate = (self.table.hits - hits) / (self.table.probes - probes)
+        return result
+
+    def set_time_limit(self, time_limit):
+        # Gives a running search, such as one pondering without a limit, a budget counted from when it started. If
+        # most of that has already gone it stops at once with the deepest iteration it has
+        self.time_limit = time_limit
+        if self.completed_depth:
+            if time.perf_counter() - self.start_time >= time_limit * SOFT_TIME_FRACTION:
+                self.deadline = self.start_time
+            else:
+                self.deadline = self.start_time + time_limit
+
+    def _aspiration_search(self, position, depth, previous_score):
+        if depth < ASPIRATION_MIN_DEPTH or abs(previous_score) >= MATE_BOUND:
+            return self._negamax(position, depth, -INFINITY, INFINITY, 0, True)
+        window = ASPIRATION_WINDOW
+        alpha, beta = previous_score - window, previous_score + window
+        while True:
+            score = self._negamax(position, depth, alpha, beta, 0, True)
+            if self.stopped or alpha < score < beta:
+                return score
+            window *= 2  # The score fell outside the window, widen that side and search again
+            if score <= alpha:
+                alpha = max(score - window, -INFINITY)
+            else:
+                beta = min(score + window, INFINITY)
+
+    def _check_time(self):
+        if self.deadline is not None and time.perf_counter() >= self.deadline \
+                or self.stop_event is not None and self.stop_event.is_set():
+            self.stopped = True
+
+    def _negamax(self, position, depth, alpha, beta, ply, on_pv):
+        in_check = position.in_check()
+        if in_check:
+            depth += 1  # Check extension, so mates and escapes aren't cut off at the horizon
+        if depth <= 0 or ply >= MAX_PLY:
+            return self._quiescence(position, alpha, beta, ply)
+
+        self.nodes += 1
+        if not self.nodes & TIME_CHECK_MASK:
+            self._check_time()
+        self.pv_table[ply] = []
+        if ply and (position.halfmove_clock >= 100 or position.is_repetition()):
+            return 0  # A repetition is scored as the draw it can be turned into
+        if ply and self.tablebases is not None:
+            score = self.tablebases.probe_score(position, ply)
+            if score is not None:
+                return score
+
+        hash_move = NO_MOVE
+        entry = self.table.probe(position.key)
+        if entry is not None:
+            hash_move, table_score, table_depth, bound = entry
+            if ply and table_depth >= depth:
+                table_score = score_from_table(table_score, ply)
+                if bound == EXACT or bound == LOWER_BOUND and table_score >= beta \
+                        or bound == UPPER_BOUND and table_score <= alpha:
+                    return table_score
+
+        pv_move = self.previous_pv[ply] if on_pv and ply < len(self.previous_pv) else NO_MOVE
+        original_alpha = alpha
+        best_score = -INFINITY
+        best_move = NO_MOVE
+        searched = 0
+        for move in self._staged_moves(position, ply, pv_move or hash_move, depth == 1):
+            searched += 1
+            position.make_move(move)
+            score = -self._negamax(position, depth - 1, -beta, -alpha, ply + 1, move == pv_move)
+            position.unmake_move()
+            if self.stopped:
+                return 0
+            if score > best_score:
+                best_score = score
+                best_move = move
+                if score > alpha:
+                    alpha = score
+                    self.pv_table[ply] = [move] + self.pv_table[ply + 1]
+                    if score >= beta:
+                        self._store_cutoff(position, move, depth, ply)
+                        self.cutoffs[min(searched, CUTOFF_SLOTS) - 1] += 1
+                        break
+        self.searched_moves += searched
+        if best_score == -INFINITY:  # There were no legal moves
+            return -MATE_SCORE + ply if in_check else 0
+
+        if best_score >= beta:
+            bound = LOWER_BOUND
+        elif best_score > original_alpha:
+            bound = EXACT
+        else:
+            bound = UPPER_BOUND
+            best_move = NO_MOVE  # Every move failed low, none of them is known to be best
+        self.table.store(position.key, best_move, score_to_table(best_score, ply), depth, bound)
+        return best_score
+
+    def _quiescence(self, position, alpha, beta, ply):
+        # Only captures and promotions are searched, so the static evaluation is never taken in the middle of an
+        # exchange. The side to move may also stand pat on the evaluation when it is not in check
+        self.nodes += 1
+        self.quiescence_nodes += 1
+        if not self.nodes & TIME_CHECK_MASK:
+            self._check_time()
+        self.pv_table[ply] = []
+        if self.tablebases is not None:
+            score = self.tablebases.probe_score(position, ply)
+            if score is not None:
+                return score
+
+        if position.in_check():
+            moves = position.generate_moves(self.move_buffers[ply])  # Every evasion has to be looked at
+            if not moves:
+                return -MATE_SCORE + ply
+            if ply >= MAX_PLY:
+                return self._evaluate(position)
+            best_score = -INFINITY
+        else:
+            # Standing pat comes first, so a node it cuts off never generates moves. A stalemate is only seen by
+            # the full-width search
+            best_score = self._evaluate(position)
+            if best_score >= beta or ply >= MAX_PLY:
+                return best_score
+            alpha = max(alpha, best_score)
+            moves = position.generate_moves(self.move_buffers[ply], TACTICAL_MOVES)
+        self.generated_moves += len(moves)
+        self._order_moves(position, moves, ply, NO_MOVE)
+        if self.batch_evaluator is not None and len(moves) >= BATCH_MIN_LEAVES:
+            self._evaluate_children(position, moves)
+
+        searched = 0
+        for move in moves:
+            searched += 1
+            position.make_move(move)
+            score = -self._quiescence(position, -beta, -alpha, ply + 1)
+            position.unmake_move()
+            if self.stopped:
+                return 0
+            if score > best_score:
+                best_score = score
+                if score > alpha:
+                    alpha = score
+                    self.pv_table[ply] = [move] + self.pv_table[ply + 1]
+                    if score >= beta:
+                        break
+        self.searched_moves += searched
+        return best_score
+
+    def _staged_moves(self, position, ply, first_move, batch):
+        # Yields the moves of a node one stage at a time: the previous best or hash move, winning captures and
+        # promotions, the killers, quiet moves by history and last the losing captures. Most nodes are cut off by one
+        # of the first few moves, and then the later stages are never generated or sorted. batch evaluates the
+        # children of each stage in one call first, when there is a batch evaluator
+        if first_move != NO_MOVE:
+            if position.is_legal(first_move):
+                yield first_move
+            else:
+                first_move = NO_MOVE  # A hash collision, or a line from a different position
+
+        batch = batch and self.batch_evaluator is not None
+        mailbox = position.mailbox
+        moves = position.generate_moves(self.move_buffers[ply], TACTICAL_MOVES)
+        self.generated_moves += len(moves)
+        self._order_moves(position, moves, ply, NO_MOVE)
+        if batch and len(moves) >= BATCH_MIN_LEAVES:
+            self._evaluate_children(position, moves)
+        losing = None
+        them = position.side ^ 1
+        for move in moves:
+            if move == first_move:
+                continue
+            end = move >> MOVE_END_SHIFT & 63
+            victim = mailbox[end]
+            if victim != EMPTY and EXCHANGE_VALUES[mailbox[move & 63] % 6] > EXCHANGE_VALUES[victim % 6] \
+                    and position.is_square_attacked(end, them):
+                if losing is None:
+                    losing = []
+                losing.append(move)
+            else:
+                yield move
+
+        ep_square = position.ep_square
+        killers = []
+        for killer in self.killers[ply]:
+            # A killer that captures here was already searched with the tactical moves
+            if killer != NO_MOVE and killer != first_move and not killer >> MOVE_PROMOTION_SHIFT \
+                    and mailbox[killer >> MOVE_END_SHIFT & 63] == EMPTY and killer >> MOVE_END_SHIFT & 63 != ep_square \
+                    and position.is_legal(killer):
+                killers.append(killer)
+                yield killer
+
+        moves = position.generate_moves(self.quiet_buffers[ply], QUIET_MOVES)
+        self.generated_moves += len(moves)
+        history = self.history
+        moves.sort(key=lambda move: history[mailbox[move & 63]][move >> MOVE_END_SHIFT & 63], reverse=True)
+        if batch and len(moves) >= BATCH_MIN_LEAVES:
+            self._evaluate_children(position, moves)
+        for move in moves:
+            if move != first_move and move not in killers:
+                yield move
+
+        if losing is not None:
+            yield from losing
+
+    def _evaluate(self, position):
+        score = self.leaf_scores.get(position.key)
+        return score if score is not None else evaluate(position)
+
+    def _evaluate_children(self, position, moves):  # Fills leaf_scores with the positions after each of the moves
+        pieces = []
+        sides = []
+        keys = []
+        for move in moves:
+            position.make_move(move)
+            pieces.append(position.pieces[:])
+            sides.append(position.side)
+            keys.append(position.key)
+            position.unmake_move()
+        self.leaf_scores = dict(zip(keys, self.batch_evaluator.evaluate(pieces, sides).tolist()))
+
+    def _order_moves(self, position, moves, ply, pv_move):
+        mailbox = position.mailbox
+        first_killer, second_killer = self.killers[ply]
+        history = self.history
+
+        def move_score(move):
+            if move == pv_move:
+                return PV_MOVE_SCORE
+            start = move & 63
+            end = move >> MOVE_END_SHIFT & 63
+            victim = mailbox[end]
+            if victim != EMPTY:  # Most valuable victim first, then least valuable attacker
+                return CAPTURE_SCORE + (victim % 6) * 8 - mailbox[start] % 6 + (move >> MOVE_PROMOTION_SHIFT)
+            if move >> MOVE_PROMOTION_SHIFT:
+                return PROMOTION_SCORE + (move >> MOVE_PROMOTION_SHIFT)
+            if move == first_killer:
+                return KILLER_SCORE + 1
+            if move == second_killer:
+                return KILLER_SCORE
+            return history[mailbox[start]][end]
+
+        moves.sort(key=move_score, reverse=True)
+
+    def _store_cutoff(self, position, move, depth, ply):
+        start = move & 63
+        end = move >> MOVE_END_SHIFT & 63
+        if position.mailbox[end] != EMPTY or move >> MOVE_PROMOTION_SHIFT:
+            return  # Captures and promotions are already ordered first
+        killers = self.killers[ply]
+        if killers[0] != move:
+            killers[1] = killers[0]
+            killers[0] = move
+        piece_history = self.history[position.mailbox[start]]
+        piece_history[end] += depth * depth
+        if piece_history[end] > HISTORY_LIMIT:
+            for piece_history in self.history:
+                for sq in range(64):
+                    piece_history[sq] >>= 1
+
+
+def wrap_pv(position, pv):  # Turns the packed moves of a line into Move objects, reading each from its own board
+    moves = []
+    for move in pv:
+        moves.append(Move(move, position.mailbox))
+        position.make_move(move)
+    for _ in pv:
+        position.unmake_move()
+    return moves
+
+
+def format_score(score):
+    if abs(score) >= MATE_BOUND:
+        plies = MATE_SCORE - abs(score)
+        return "mate {}".format((plies + 1) // 2 if score > 0 else -((plies + 1) // 2))
+    return "cp {}".format(score)
+
+
+def print_iteration(result):
+    print("depth {} score {} nodes {} nps {} time {:.2f} pv {}".format(
+        result.depth, format_score(result.score), result.nodes,
+        round(result.nodes / result.seconds) if result.seconds else 0, result.seconds,
+        " ".join(move_to_uci(move.move) for move in result.pv)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Search a position for the best move")
+    parser.add_argument("--fen", help="the position to search (default: the starting position)")
+    parser.add_argument("--time", type=float, help="the time budget in seconds")
+    parser.add_argument("--depth", type=int, help="the depth to search to")
+    parser.add_argument("--hash", type=int, default=16, help="the transposition table size in MB")
+    parser.add_argument("--batch-eval", action="store_true", help="evaluate the leaves of a node in NumPy batches")
+    parser.add_argument("--weights", help="a JSON evaluation weights file, as written by evaluation.save_weights")
+    parser.add_argument("--tablebases", help="an endgame tablebase file, as written by tablebase.py --generate")
+    parser.add_argument("--stats", metavar="FILE", help="count and time the search's work and save it as JSON")
+    args = parser.parse_args()
+
+    if args.weights:
+        load_weights(args.weights)
+    batch_evaluator = None
+    if args.batch_eval:
+        from batch_evaluation import BatchEvaluator  # Only this needs NumPy
+        batch_evaluator = BatchEvaluator()
+    tablebases = None
+    if args.tablebases:
+        from tablebase import Tablebases  # It imports this module for the mate scores
+        tablebases = Tablebases(args.tablebases)
+    instrumentation = Instrumentation() if args.stats else None
+    searcher = Searcher(args.hash, batch_evaluator=batch_evaluator, tablebases=tablebases,
+                        instrumentation=instrumentation)
+    result = searcher.search(GameState(args.fen), time_limit=args.time, depth=args.depth, on_iteration=print_iteration)
+    print("hash hit rate {:.1%}".format(result.hash_hit_rate))
+    if result.best_move is not None:
+        print("bestmove {}".format(move_to_uci(result.best_move.move)))
+    if instrumentation is not None:
+        instrumentation.save(args.stats)
+        print(instrumentation.summary())
+
+
+if __name__ == "__main__":
+    main()
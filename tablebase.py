@@ -0,0 +1,397 @@
+import argparse
+import mmap
+import os
+import struct
+import time
+
+from bitboard import WHITE, BLACK, PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING, EMPTY, NO_MOVE, MOVE_END_SHIFT, \
+    MOVE_PROMOTION_SHIFT, KING_ATTACKS, KNIGHT_ATTACKS, bishop_attacks, rook_attacks, queen_attacks, move_to_uci, \
+    squares, Position
+from chess_engine import GameState
+from search import MATE_SCORE
+
+# Endgame tables for a lone king against a king and one or two other pieces, solved by retrograde analysis. Every
+# position gets one byte, 0 for a draw (or a position that can't occur) and otherwise 1 + the plies to mate with best
+# play. The side to move wins when it mates in an odd number of plies, so an even byte is a win and an odd one a
+# loss. The tables are always worked out with white as the side with the pieces, a position with black as that side
+# is looked up with its colours and rows swapped
+DEFAULT_TABLES = ["KQK", "KRK", "KPK", "KBNK"]
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tablebases.bin")
+PIECE_ORDER = "QRBNP"  # The order pieces are written in a table name
+PIECE_LETTERS = "PNBRQK"  # By piece type
+MAGIC = b"TBL1"
+HEADER = struct.Struct("<4sI")  # Magic, number of tables
+TABLE_ENTRY = struct.Struct("<8sQQ")  # Name, offset of its data in the file, size in bytes
+
+
+def _symmetry(swap, flip_rows, flip_columns):  # One of the 8 ways to turn or mirror the board, as a square map
+    mapping = []
+    for sq in range(64):
+        r, c = divmod(sq, 8)
+        if swap:
+            r, c = c, r
+        mapping.append((7 - r if flip_rows else r) * 8 + (7 - c if flip_columns else c))
+    return mapping
+
+
+SYMMETRIES = [_symmetry(swap, flip_rows, flip_columns) for swap in (False, True) for flip_rows in (False, True)
+              for flip_columns in (False, True)]  # SYMMETRIES[0] changes nothing and SYMMETRIES[1] mirrors the files
+TRIANGLE = [56, 57, 58, 59, 49, 50, 51, 42, 43, 35]  # a1-d1-d4, where the 8 symmetries can put any square
+PAWN_SQUARES = [r * 8 + c for r in range(1, 7) for c in range(4)]  # Files a-d, mirroring puts any pawn there
+
+
+def material_name(piece_types):  # 'KRBK' style name for a king and these pieces against a lone king
+    return "K" + "".join(sorted((PIECE_LETTERS[piece_type] for piece_type in piece_types), key=PIECE_ORDER.index)) \
+        + "K"
+
+
+def is_trivial_draw(piece_types):  # Nothing, or a single minor piece, can't mate
+    return not piece_types or len(piece_types) == 1 and piece_types[0] in (KNIGHT, BISHOP)
+
+
+class TableLayout:
+    # How a table is indexed. A position is a placement: the squares of the white king, the black king and then the
+    # other pieces in name order. The leader (the white king, or the pawn) is moved into its reduced domain by a
+    # symmetry and every other piece adds a factor of 64. When two symmetries both put the leader in its domain, the
+    # one giving the smaller index is used, so every position has exactly one index. Two pieces of the same kind are
+    # an unordered pair, indexed with the lower square first
+    def __init__(self, name):
+        self.name = name
+        self.piece_types = [PIECE_LETTERS.index(letter) for letter in name[1:-1]]
+        if not 1 <= len(self.piece_types) <= 2 or name != material_name(self.piece_types):
+            raise ValueError("unsupported table " + name)
+        if self.piece_types.count(PAWN) > 1:
+            raise ValueError("unsupported table {}: two pawns would need tables with two pawns against one".format(
+                name))
+        self.pair = len(self.piece_types) == 2 and self.piece_types[0] == self.piece_types[1]
+        if PAWN in self.piece_types:  # A pawn only lets the board be mirrored left to right
+            self.leader = 2 + self.piece_types.index(PAWN)
+            domain, transforms = PAWN_SQUARES, (0, 1)
+        else:
+            self.leader = 0
+            domain, transforms = TRIANGLE, range(8)
+        self.domain = domain
+        self.domain_index = [-1] * 64
+        for index, sq in enumerate(domain):
+            self.domain_index[sq] = index
+        self.others = [slot for slot in range(2 + len(self.piece_types)) if slot != self.leader]
+        self.candidates = [[SYMMETRIES[t] for t in transforms if self.domain_index[SYMMETRIES[t][sq]] >= 0]
+                           for sq in range(64)]
+        self.positions = len(domain) * 64 ** len(self.others)
+        self.piece_indexes = [KING, 6 + KING] + self.piece_types  # White pieces, apart from the black king
+
+    def index(self, placement):
+        leader_square = placement[self.leader]
+        best = None
+        for mapping in self.candidates[leader_square]:
+            index = self.domain_index[mapping[leader_square]]
+            for slot in self.others:
+                index = index * 64 + mapping[placement[slot]]
+            if self.pair:  # The pair are the last two slots, since only a pawn leads instead of the king
+                first, second = index >> 6 & 63, index & 63
+                if first > second:
+                    index += (second - first) * 63
+            if best is None or index < best:
+                best = index
+        return best
+
+    def placement(self, index):
+        placement = [0] * (2 + len(self.piece_types))
+        for slot in reversed(self.others):
+            index, placement[slot] = divmod(index, 64)
+        placement[self.leader] = self.domain[index]
+        return placement
+
+
+def _set_up(position, layout, placement, side):
+    for sq in range(64):
+        position.mailbox[sq] = EMPTY
+    position.pieces = [0] * 12
+    position.occupied = [0, 0]
+    for piece, sq in zip(layout.piece_indexes, placement):
+        position.put_piece(piece, sq)
+    position.side = side
+
+
+def _origins(piece_type, sq, occupied):  # The empty squares a white piece on sq could have just come from
+    empty = ~occupied
+    if piece_type == KING:
+        return KING_ATTACKS[sq] & empty
+    if piece_type == KNIGHT:
+        return KNIGHT_ATTACKS[sq] & empty
+    if piece_type == BISHOP:
+        return bishop_attacks(sq, occupied) & empty
+    if piece_type == ROOK:
+        return rook_attacks(sq, occupied) & empty
+    if piece_type == QUEEN:
+        return queen_attacks(sq, occupied) & empty
+    origins = 0  # White pawns move towards row 0, so they came from the row below
+    if sq // 8 <= 5 and not occupied >> (sq + 8) & 1:
+        origins = 1 << (sq + 8)
+        if sq // 8 == 4 and not occupied >> (sq + 16) & 1:
+            origins |= 1 << (sq + 16)
+    return origins
+
+
+def generate(name, tables=None):
+    # Solves one table and returns it as a bytearray of 2 entries (white, then black to move) per index. tables
+    # holds the already solved tables that captures and promotions lead to, as {name: bytearray}
+    tables = {} if tables is None else tables
+    layout = TableLayout(name)
+    nodes = layout.positions * 2
+    values = bytearray(nodes)
+    counts = bytearray(nodes)  # Moves not yet known to lose, 0 for positions that are settled or can't occur
+    win_events = {}  # Plies -> positions a capture or promotion wins for in that many plies
+    loss_events = {}  # Plies -> positions that have one more move known to lose at that point
+    frontier = []  # The positions solved at the current number of plies
+    position = Position()
+    layouts = {}
+
+    for index in range(layout.positions):
+        placement = layout.placement(index)
+        if len(set(placement)) < len(placement) or layout.index(placement) != index:
+            continue  # Two pieces on one square, or the same position as a smaller index
+        for side in (WHITE, BLACK):
+            _set_up(position, layout, placement, side)
+            if position.in_check(side ^ 1):
+                continue  # The side that just moved can't be in check
+            node = index * 2 + side
+            moves = position.generate_moves()
+            if not moves:
+                if position.in_check():
+                    values[node] = 1  # Mated
+                    frontier.append(node)
+                continue
+            successors = set()
+            exits = 0
+            for move in moves:
+                start, end = move & 63, move >> MOVE_END_SHIFT & 63
+                promotion = move >> MOVE_PROMOTION_SHIFT
+                slot = placement.index(start)
+                if position.mailbox[end] == EMPTY and not promotion:
+                    successor = placement[:]
+                    successor[slot] = end
+                    successors.add(layout.index(successor))
+                    continue
+                # A capture or a promotion leaves this table, its result is looked up in a smaller or other one
+                exits += 1
+                piece_types = layout.piece_types[:]
+                successor = placement[:]
+                if promotion:
+                    piece_types[slot - 2] = promotion
+                    successor[slot] = end
+                else:
+                    captured = placement.index(end)
+                    del piece_types[captured - 2]
+                    del successor[captured]
+                    successor[1] = end  # Only the lone king can capture
+                if is_trivial_draw(piece_types):
+                    continue
+                sub_name = material_name(piece_types)
+                sub_layout = layouts.get(sub_name) or layouts.setdefault(sub_name, TableLayout(sub_name))
+                order = [0, 1] + sorted(range(2, len(successor)), key=lambda s: PIECE_ORDER.index(
+                    PIECE_LETTERS[piece_types[s - 2]]))
+                result = tables[sub_name][sub_layout.index([successor[s] for s in order]) * 2 + (side ^ 1)]
+                if result:  # 1 + the opponent's plies to mate is the plies to mate for this side
+                    (win_events if result % 2 else loss_events).setdefault(result, []).append(node)
+            counts[node] = len(successors) + exits
+
+    plies = 0
+    while frontier or win_events or loss_events:
+        solved = []
+        for node in frontier:  # Every position that can move into this one gets a win or one more lost move
+            index, side = divmod(node, 2)
+            lost = values[node] % 2
+            placement = layout.placement(index)
+            occupied = 0
+            for sq in placement:
+                occupied |= 1 << sq
+            predecessors = set()
+            mover = side ^ 1
+            for slot in ((0, *range(2, len(placement))) if mover == WHITE else (1,)):
+                piece_type = KING if slot < 2 else layout.piece_types[slot - 2]
+                origins = _origins(piece_type, placement[slot], occupied)
+                while origins:
+                    low = origins & -origins
+                    origins ^= low
+                    predecessor = placement[:]
+                    predecessor[slot] = low.bit_length() - 1
+                    predecessors.add(layout.index(predecessor) * 2 + mover)
+            for predecessor in predecessors:
+                if not counts[predecessor] or values[predecessor]:
+                    continue
+                if lost:
+                    values[predecessor] = plies + 2
+                    solved.append(predecessor)
+                else:
+                    counts[predecessor] -= 1
+                    if not counts[predecessor]:
+                        values[predecessor] = plies + 2
+                        solved.append(predecessor)
+        plies += 1
+        for node in win_events.pop(plies, ()):
+            if counts[node] and not values[node]:
+                values[node] = plies + 1
+                solved.append(node)
+        for node in loss_events.pop(plies, ()):
+            if counts[node] and not values[node]:
+                counts[node] -= 1
+                if not counts[node]:
+                    values[node] = plies + 1
+                    solved.append(node)
+        frontier = solved
+    return values
+
+
+def dependencies(name):  # The tables the captures and promotions of a table lead to, which are solved first
+    piece_types = TableLayout(name).piece_types
+    names = []
+    for index in range(len(piece_types)):
+        results = [piece_types[:index] + piece_types[index + 1:]]
+        if piece_types[index] == PAWN:
+            results += [piece_types[:index] + [promotion] + piece_types[index + 1:]
+                        for promotion in (KNIGHT, BISHOP, ROOK, QUEEN)]
+        for result in results:
+            if not is_trivial_draw(result):
+                names.append(material_name(result))
+    return names
+
+
+def write_tables(path, names, report=print):
+    # Solves the tables named, and any they depend on, and writes them all to one file: a header, then one
+    # (name, offset, size) entry per table, then the tables
+    tables = {}
+
+    def solve(name):
+        if name in tables:
+            return
+        for dependency in dependencies(name):
+            solve(dependency)
+        start_time = time.perf_counter()
+        tables[name] = generate(name, tables)
+        values = tables[name]
+        wins = sum(1 for value in values if value and not value % 2)
+        losses = sum(1 for value in values if value % 2)
+        report("{:<6} {:>9} entries  {:>8} wins  {:>8} losses  longest mate {} plies  {:.1f}s".format(
+            name, len(values), wins, losses, max(values) - 1, time.perf_counter() - start_time))
+
+    for name in names:
+        solve(name)
+    offset = HEADER.size + TABLE_ENTRY.size * len(tables)
+    with open(path, "wb") as tables_file:
+        tables_file.write(HEADER.pack(MAGIC, len(tables)))
+        for name, values in tables.items():
+            tables_file.write(TABLE_ENTRY.pack(name.encode(), offset, len(values)))
+            offset += len(values)
+        for values in tables.values():
+            tables_file.write(values)
+    return os.path.getsize(path)
+
+
+class Tablebases:
+    # The tables of a file written by write_tables, mapped read-only. A probe works out the index and reads one
+    # byte, so it takes the same time in any table. Positions with castling rights aren't probed, the tables ignore
+    # castling
+    def __init__(self, path=DEFAULT_PATH):
+        self.file = open(path, "rb")
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, count = HEADER.unpack_from(self.data, 0)
+        if magic != MAGIC:
+            raise ValueError(path + " is not a tablebase file")
+        self.materials = {}  # Piece counts by piece index -> (layout, offset, the colour with the pieces)
+        self.max_pieces = 0
+        for number in range(count):
+            name, offset, _ = TABLE_ENTRY.unpack_from(self.data, HEADER.size + number * TABLE_ENTRY.size)
+            layout = TableLayout(name.rstrip(b"\0").decode())
+            for strong in (WHITE, BLACK):
+                counts = [0] * 12
+                counts[strong * 6 + KING] = counts[(strong ^ 1) * 6 + KING] = 1
+                for piece_type in layout.piece_types:
+                    counts[strong * 6 + piece_type] += 1
+                self.materials[tuple(counts)] = (layout, offset, strong)
+            self.max_pieces = max(self.max_pieces, 2 + len(layout.piece_types))
+
+    def probe(self, position):
+        # 1 + the plies to mate, even when the side to move wins and odd when it loses, 0 for a draw, or None when no
+        # table covers the position
+        if (position.occupied[0] | position.occupied[1]).bit_count() > self.max_pieces or position.castling:
+            return None
+        pieces = position.pieces
+        entry = self.materials.get(tuple(bb.bit_count() for bb in pieces))
+        if entry is None:
+            return None
+        layout, offset, strong = entry
+        flip = 56 if strong == BLACK else 0  # Rows swapped along with the colours, so pawns still move up
+        placement = [position.king_square(strong) ^ flip, position.king_square(strong ^ 1) ^ flip]
+        for piece_type in dict.fromkeys(layout.piece_types):  # Both squares of a pair at once
+            placement += [sq ^ flip for sq in squares(pieces[strong * 6 + piece_type])]
+        return self.data[offset + layout.index(placement) * 2 + (position.side ^ strong)]
+
+    def probe_score(self, position, ply):  # The search score of the position at this ply, or None
+        if (position.occupied[0] | position.occupied[1]).bit_count() > self.max_pieces:
+            return None
+        if position.is_insufficient_material():
+            return 0
+        value = self.probe(position)
+        if value is None:
+            return None
+        if not value:
+            return 0
+        return -(MATE_SCORE - ply - value + 1) if value % 2 else MATE_SCORE - ply - value + 1
+
+    def best_move(self, position):
+        # (move, score) for the move that mates fastest, or loses slowest, or NO_MOVE when some move leads out of the
+        # tables
+        if self.probe(position) is None:
+            return NO_MOVE, 0
+        best_move, best_score = NO_MOVE, -MATE_SCORE - 1
+        for move in position.generate_moves():
+            position.make_move(move)
+            score = self.probe_score(position, 1)
+            position.unmake_move()
+            if score is None:
+                return NO_MOVE, 0
+            if -score > best_score:
+                best_move, best_score = move, -score
+        return best_move, best_score
+
+    def close(self):
+        self.data.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate endgame tablebases or look a position up in them")
+    parser.add_argument("--generate", nargs="*", metavar="TABLE",
+                        help="solve these tables, such as KQK or KBNK (default: {})".format(" ".join(DEFAULT_TABLES)))
+    parser.add_argument("--file", default=DEFAULT_PATH, help="the tablebase file")
+    parser.add_argument("--fen", help="a position to look up")
+    args = parser.parse_args()
+
+    if args.generate is not None:
+        start_time = time.perf_counter()
+        size = write_tables(args.file, args.generate or DEFAULT_TABLES)
+        print("{} written, {} bytes in {:.1f}s".format(args.file, size, time.perf_counter() - start_time))
+    if args.fen:
+        with Tablebases(args.file) as tablebases:
+            position = GameState(args.fen).position
+            start_time = time.perf_counter()
+            value = tablebases.probe(position)
+            microseconds = (time.perf_counter() - start_time) * 1e6
+            if value is None:
+                print("not in the tables")
+                return
+            move, _ = tablebases.best_move(position)
+            outcome = "draw" if not value else "{} in {} plies".format("loss" if value % 2 else "win", value - 1)
+            print("{}, best move {} ({:.1f} microseconds per probe)".format(
+                outcome, move_to_uci(move) if move != NO_MOVE else "none", microseconds))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,289 @@
+import argparse
+import math
+import multiprocessing
+import os
+import random
+import time
+
+import evaluation
+from bitboard import WHITE, NO_MOVE, STARTING_FEN, move_to_uci
+from book import OpeningBook
+from chess_engine import GameState
+from notation import move_to_san, pgn_game
+from search import Searcher
+from tablebase import Tablebases
+
+# Short opening lines from the starting position as UCI moves. Every opening is played twice, once with each engine
+# as white, so neither gets the better side of it more often
+OPENINGS = [
+    "e2e4 e7e5 g1f3 b8c6 f1b5 a7a6",  # Ruy Lopez
+    "e2e4 e7e5 g1f3 b8c6 f1c4 f8c5",  # Italian
+    "e2e4 e7e5 g1f3 g8f6 f3e5 d7d6",  # Petrov
+    "e2e4 e7e5 f2f4 e5f4 g1f3",  # King's Gambit
+    "e2e4 e7e5 b1c3 g8f6 f2f4",  # Vienna
+    "e2e4 c7c5 g1f3 d7d6 d2d4 c5d4 f3d4 g8f6",  # Sicilian
+    "e2e4 c7c5 b1c3 b8c6 g2g3 g7g6",  # Closed Sicilian
+    "e2e4 e7e6 d2d4 d7d5 b1c3 f8b4",  # French
+    "e2e4 c7c6 d2d4 d7d5 e4e5 c8f5",  # Caro-Kann
+    "e2e4 d7d5 e4d5 d8d5 b1c3 d5a5",  # Scandinavian
+    "e2e4 g8f6 e4e5 f6d5 d2d4 d7d6",  # Alekhine
+    "e2e4 d7d6 d2d4 g8f6 b1c3 g7g6",  # Pirc
+    "d2d4 d7d5 c2c4 e7e6 b1c3 g8f6",  # Queen's Gambit Declined
+    "d2d4 d7d5 c2c4 d5c4 g1f3 g8f6",  # Queen's Gambit Accepted
+    "d2d4 d7d5 c2c4 c7c6 g1f3 g8f6",  # Slav
+    "d2d4 g8f6 c2c4 e7e6 b1c3 f8b4",  # Nimzo-Indian
+    "d2d4 g8f6 c2c4 e7e6 g1f3 b7b6",  # Queen's Indian
+    "d2d4 g8f6 c2c4 g7g6 b1c3 f8g7 e2e4 d7d6",  # King's Indian
+    "d2d4 g8f6 c2c4 c7c5 d4d5 e7e6",  # Benoni
+    "d2d4 f7f5 g2g3 g8f6 f1g2 e7e6",  # Dutch
+    "d2d4 d7d5 c1f4 g8f6 e2e3 c7c5",  # London
+    "c2c4 e7e5 b1c3 g8f6 g2g3 d7d5",  # English
+    "c2c4 c7c5 g1f3 g8f6 b1c3 b8c6",  # Symmetrical English
+    "g1f3 d7d5 g2g3 g8f6 f1g2 e7e6",  # Reti
+]
+
+MOVES_TO_GO = 30  # A move under a sudden death clock gets this share of the time left, plus most of the increment
+INCREMENT_SHARE = 0.8
+MAX_MOVE_SHARE = 0.5  # Never more than this share of the clock on one move, the first iteration can overrun
+
+_engines = None  # Set in every worker process by _init_worker: (name, weights, Searcher) for each engine
+_time_control = None
+_book = None  # Every worker maps the same book file, so there is one copy of it in the page cache
+_current_weights = None  # The weights the evaluation module is set to in this process
+
+
+def parse_time_control(text):  # (base seconds, increment seconds) from '40+0.4' or '60'
+    base, _, increment = text.partition("+")
+    return float(base), float(increment or 0)
+
+
+def load_openings(path):
+    # One opening per line, either a FEN string, an EPD line or UCI moves from the starting position. Lines starting
+    # with '#' are comments
+    openings = []
+    with open(path) as openings_file:
+        for line in openings_file:
+            line = line.split("#")[0].strip()
+            if not line:
+                continue
+            if "/" in line:
+                fields = line.split()
+                if len(fields) < 6 or not fields[4].isdigit() or not fields[5].isdigit():
+                    fields = fields[:4] + ["0", "1"]  # EPD, with opcodes such as 'id "e4";' in place of the counters
+                openings.append((" ".join(fields[:6]), []))
+            else:
+                openings.append((STARTING_FEN, line.split()))
+    return openings
+
+
+def _uci_move(position, uci):  # The packed legal move for a UCI string such as 'e7e8q'
+    for move in position.generate_moves():
+        if move_to_uci(move) == uci:
+            return move
+    raise ValueError("illegal move {} in {}".format(uci, position.fen()))
+
+
+def adjudicate(position):  # (result, reason) when the game is over in this position, or None
+    if not position.generate_moves():
+        if not position.in_check():
+            return "1/2-1/2", "stalemate"
+        return ("0-1" if position.side == WHITE else "1-0"), "checkmate"
+    if position.halfmove_clock >= 100:
+        return "1/2-1/2", "fifty move rule"
+    if position.repetition_count() >= 3:
+        return "1/2-1/2", "threefold repetition"
+    if position.is_insufficient_material():
+        return "1/2-1/2", "insufficient material"
+    return None
+
+
+def _init_worker(engines, hash_mb, time_control, book_path, tablebases_path):
+    global _engines, _time_control, _current_weights, _book
+    tablebases = Tablebases(tablebases_path) if tablebases_path else None  # Mapped once, shared by both engines
+    _engines = [(name, weights, Searcher(hash_mb, tablebases=tablebases)) for name, weights in engines]
+    _time_control = time_control
+    _current_weights = None
+    _book = OpeningBook(book_path) if book_path else None
+
+
+def _use_weights(engine):  # The evaluation module holds one set of weights, only switched when the engines differ
+    global _current_weights
+    weights = _engines[engine][1]
+    if weights != _current_weights:
+        evaluation.set_weights(weights)
+        _current_weights = weights
+
+
+def _move_time(clock, increment):
+    return min(clock / MOVES_TO_GO + increment * INCREMENT_SHARE, clock * MAX_MOVE_SHARE)
+
+
+def play_game(task):
+    # Plays one game in a worker process and returns (round, white engine, result, reason, PGN text). The engines
+    # only share the process, every one has its own Searcher and transposition table
+    round_number, fen, opening_moves, white = task
+    base, increment, move_time, depth = _time_control
+    game_state = GameState(fen)
+    position = game_state.position
+    sans = []
+    for uci in opening_moves:
+        move = _uci_move(position, uci)
+        sans.append(move_to_san(position, move))
+        position.make_move(move)
+    for _, _, searcher in _engines:
+        searcher.table.clear()  # No game is helped by what was found in the previous one
+
+    clocks = [base, base]
+    while True:
+        ending = adjudicate(position)
+        if ending is not None:
+            result, reason = ending
+            break
+        if _book is not None:
+            move = _book.choose(position)
+            if move != NO_MOVE:  # Played at once, it costs neither engine clock time
+                sans.append(move_to_san(position, move))
+                position.make_move(move)
+                continue
+        side = position.side
+        engine = white if side == WHITE else 1 - white
+        _use_weights(engine)
+        time_limit = move_time if move_time else _move_time(clocks[side], increment) if base else None
+        start_time = time.perf_counter()
+        search_result = _engines[engine][2].search(game_state, time_limit=time_limit, depth=depth)
+        if base:
+            clocks[side] -= time.perf_counter() - start_time
+            if clocks[side] < 0:
+                result, reason = ("0-1" if side == WHITE else "1-0"), "time forfeit"
+                break
+            clocks[side] += increment
+        move = search_result.best_move.move
+        sans.append(move_to_san(position, move))
+        position.make_move(move)
+
+    tags = {"Event": "Tournament", "Site": "?", "Round": round_number, "White": _engines[white][0],
+            "Black": _engines[1 - white][0], "Termination": reason, "PlyCount": len(sans)}
+    if base:
+        tags["TimeControl"] = "{:g}+{:g}".format(base, increment)
+    return round_number, white, result, reason, pgn_game(tags, sans, result, fen)
+
+
+def elo_difference(wins, draws, losses):
+    # The logistic Elo difference the score implies, with its 95% error margin, from the first engine's side
+    games = wins + draws + losses
+    score = (wins + draws / 2) / games
+    if score <= 0 or score >= 1:
+        return (math.inf if score >= 1 else -math.inf), math.inf
+    deviation = math.sqrt((wins * (1 - score) ** 2 + draws * (0.5 - score) ** 2 + losses * score ** 2) / games)
+    margin = 1.96 * deviation / math.sqrt(games)
+
+    def elo(s):
+        return 400 * math.log10(s / (1 - s)) if 0 < s < 1 else math.copysign(math.inf, s - 0.5)
+
+    return elo(score), (elo(score + margin) - elo(score - margin)) / 2
+
+
+def sprt_llr(wins, draws, losses, elo0, elo1):
+    # The log likelihood ratio of elo1 against elo0, by the normal approximation of the game scores. It starts at 0
+    # and the test ends when it passes one of the bounds from sprt_bounds
+    games = wins + draws + losses
+    if not games or not wins + losses:
+        return 0.0
+    score = (wins + draws / 2) / games
+    variance = (wins * (1 - score) ** 2 + draws * (0.5 - score) ** 2 + losses * score ** 2) / games
+    if variance <= 0:
+        return 0.0
+    score0 = 1 / (1 + 10 ** (-elo0 / 400))
+    score1 = 1 / (1 + 10 ** (-elo1 / 400))
+    return games * (score1 - score0) * (2 * score - score0 - score1) / (2 * variance)
+
+
+def sprt_bounds(alpha, beta):  # (lower, upper): below lower elo0 is accepted, above upper elo1
+    return math.log(beta / (1 - alpha)), math.log((1 - beta) / alpha)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Play engine against engine games over a pool of processes")
+    parser.add_argument("--games", type=int, default=100, help="the number of games")
+    parser.add_argument("--workers", type=int, default=multiprocessing.cpu_count(),
+                        help="the number of games played at once (default: one per core)")
+    parser.add_argument("--tc", default="10+0.1", help="the time control as base+increment seconds per game")
+    parser.add_argument("--movetime", type=float, help="a fixed time per move in seconds instead of a clock")
+    parser.add_argument("--depth", type=int, help="a fixed depth per move instead of a clock")
+    parser.add_argument("--first", help="a JSON evaluation weights file for the first engine (default: built in)")
+    parser.add_argument("--second", help="a JSON evaluation weights file for the second engine (default: built in)")
+    parser.add_argument("--hash", type=int, default=8, help="the transposition table size of each engine in MB")
+    parser.add_argument("--openings", help="a file of openings, one FEN string or UCI move line per line")
+    parser.add_argument("--seed", type=int, default=1, help="shuffles the order the openings are played in")
+    parser.add_argument("--book", help="a Polyglot opening book both engines play from after the opening")
+    parser.add_argument("--tablebases", help="an endgame tablebase file both engines probe")
+    parser.add_argument("--pgn", help="append the games to this PGN file as they finish")
+    parser.add_argument("--sprt", nargs=2, type=float, metavar=("ELO0", "ELO1"),
+                        help="stop once a sequential probability ratio test decides between these Elo differences")
+    parser.add_argument("--alpha", type=float, default=0.05, help="the SPRT false positive rate")
+    parser.add_argument("--beta", type=float, default=0.05, help="the SPRT false negative rate")
+    args = parser.parse_args()
+
+    defaults = evaluation.get_weights()
+    engines = []
+    for path in (args.first, args.second):
+        weights = dict(defaults)
+        if path:  # A complete set of weights for each engine, so switching one never leaves the other's behind
+            evaluation.load_weights(path)
+            weights = evaluation.get_weights()
+            evaluation.set_weights(defaults)
+        engines.append([os.path.splitext(os.path.basename(path))[0] if path else "base", weights])
+    if engines[0][0] == engines[1][0]:
+        engines[0][0] += "-1"
+        engines[1][0] += "-2"
+
+    if args.movetime or args.depth:
+        time_control = (0, 0, args.movetime, args.depth)
+    else:
+        time_control = parse_time_control(args.tc) + (None, None)
+    openings = load_openings(args.openings) if args.openings else [(STARTING_FEN, line.split()) for line in OPENINGS]
+    random.Random(args.seed).shuffle(openings)
+    tasks = [(number + 1,) + openings[number // 2 % len(openings)] + (number % 2,) for number in range(args.games)]
+
+    pgn_file = open(args.pgn, "a") if args.pgn else None
+    wins = draws = losses = 0  # From the first engine's side
+    bounds = sprt_bounds(args.alpha, args.beta) if args.sprt else None
+    start_time = time.perf_counter()
+    print("{} vs {}, {} games on {} processes".format(engines[0][0], engines[1][0], args.games, args.workers))
+    with multiprocessing.Pool(args.workers, _init_worker, ([tuple(engine) for engine in engines], args.hash,
+                                                           time_control, args.book, args.tablebases)) as pool:
+        for round_number, white, result, reason, pgn in pool.imap_unordered(play_game, tasks):
+            if pgn_file is not None:
+                pgn_file.write(pgn)
+                pgn_file.flush()
+            if result == "1/2-1/2":
+                draws += 1
+            elif (result == "1-0") == (white == 0):
+                wins += 1
+            else:
+                losses += 1
+            games = wins + draws + losses
+            elo, margin = elo_difference(wins, draws, losses)
+            line = "{:>5}  {:<8} {} vs {} ({})  +{} ={} -{}  elo {:+.1f} +/- {:.1f}  {:.1f} games/min".format(
+                games, result, engines[white][0], engines[1 - white][0], reason, wins, draws, losses, elo, margin,
+                games * 60 / (time.perf_counter() - start_time))
+            if bounds:
+                llr = sprt_llr(wins, draws, losses, *args.sprt)
+                line += "  llr {:.2f} [{:.2f}, {:.2f}]".format(llr, *bounds)
+                if not bounds[0] < llr < bounds[1]:
+                    print(line)
+                    print("SPRT: {} accepted".format("elo1 ({:g})".format(args.sprt[1]) if llr >= bounds[1]
+                                                     else "elo0 ({:g})".format(args.sprt[0])))
+                    break
+            print(line, flush=True)
+    if pgn_file is not None:
+        pgn_file.close()
+
+    games = wins + draws + losses
+    elo, margin = elo_difference(wins, draws, losses)
+    print("{} vs {}: +{} ={} -{}, score {:.1%}, elo {:+.1f} +/- {:.1f}".format(
+        engines[0][0], engines[1][0], wins, draws, losses, (wins + draws / 2) / games, elo, margin))
+
+
+if __name__ == "__main__":
+    main()
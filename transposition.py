@@ -0,0 +1,98 @@
+from array import array
+
+from bitboard import NO_MOVE
+
+EXACT, LOWER_BOUND, UPPER_BOUND = 1, 2, 3  # What the stored score is to the true score
+
+# The data word of an entry packs everything but the key into 64 bits:
+# move (15 bits, as packed by the move generator) | score + SCORE_OFFSET (21) | depth (8) | bound (2) | generation (6)
+SCORE_OFFSET = 1 << 20
+MOVE_BITS, SCORE_BITS, DEPTH_BITS, BOUND_BITS, GENERATION_BITS = 15, 21, 8, 2, 6
+SCORE_SHIFT = MOVE_BITS
+DEPTH_SHIFT = SCORE_SHIFT + SCORE_BITS
+BOUND_SHIFT = DEPTH_SHIFT + DEPTH_BITS
+GENERATION_SHIFT = BOUND_SHIFT + BOUND_BITS
+ENTRY_WORDS = 2  # The key (XORed with the data) and the data
+BUCKET_ENTRIES = 2  # A depth-preferred slot and an always-replace slot
+BUCKET_WORDS = ENTRY_WORDS * BUCKET_ENTRIES
+BUCKET_BYTES = BUCKET_WORDS * 8
+
+
+def table_bytes(size_mb):  # The bytes a table capped at size_mb takes up
+    buckets = 1
+    while buckets * 2 * BUCKET_BYTES <= size_mb * 1024 * 1024:
+        buckets *= 2  # A power of two, so a bucket is found with a mask instead of a division
+    return buckets * BUCKET_BYTES
+
+
+class TranspositionTable:
+    # A fixed number of two-entry buckets in one preallocated array of 64-bit words, so the memory used never grows
+    # past the cap. The first entry of a bucket keeps the deepest search and the second one takes everything else.
+    # Keys are stored XORed with their data, so an entry whose two words don't belong together never matches. That
+    # also makes it safe for several processes to share one table through a buffer: an entry torn by two writers at
+    # once just reads as a miss
+    def __init__(self, size_mb=16, buffer=None):
+        size = table_bytes(size_mb)
+        self.bucket_mask = size // BUCKET_BYTES - 1
+        if buffer is None:
+            self.table = array("Q", bytes(size))
+        else:  # Shared memory from the caller, at least table_bytes(size_mb) long
+            self.table = memoryview(buffer).cast("B")[:size].cast("Q")
+        self.generation = 0
+        self.probes = 0
+        self.hits = 0
+        self.stores = 0
+
+    @property
+    def size_mb(self):
+        return len(self.table) * 8 / (1024 * 1024)
+
+    def new_search(self):  # Entries from earlier searches become the first to be replaced
+        self.generation = (self.generation + 1) & ((1 << GENERATION_BITS) - 1)
+
+    def clear(self):
+        memoryview(self.table).cast("B")[:] = bytes(len(self.table) * 8)  # In place, a shared buffer stays shared
+        self.generation = 0
+        self.probes = self.hits = self.stores = 0
+
+    def probe(self, key):  # (move or NO_MOVE, score, depth, bound) stored for the key, or None
+        self.probes += 1
+        table = self.table
+        index = (key & self.bucket_mask) * BUCKET_WORDS
+        for slot in (index, index + ENTRY_WORDS):
+            data = table[slot + 1]
+            if table[slot] ^ data == key and data:
+                self.hits += 1
+                return (data & ((1 << MOVE_BITS) - 1),
+                        (data >> SCORE_SHIFT & ((1 << SCORE_BITS) - 1)) - SCORE_OFFSET,
+                        data >> DEPTH_SHIFT & ((1 << DEPTH_BITS) - 1),
+                        data >> BOUND_SHIFT & 3)
+        return None
+
+    def store(self, key, move, score, depth, bound):
+        self.stores += 1
+        table = self.table
+        index = (key & self.bucket_mask) * BUCKET_WORDS
+        data = (move | (score + SCORE_OFFSET) << SCORE_SHIFT | max(depth, 0) << DEPTH_SHIFT
+                | bound << BOUND_SHIFT | self.generation << GENERATION_SHIFT)
+
+        old_data = table[index + 1]
+        same_key = table[index] ^ old_data == key
+        if not old_data or same_key or depth >= old_data >> DEPTH_SHIFT & ((1 << DEPTH_BITS) - 1) \
+                or old_data >> GENERATION_SHIFT != self.generation:
+            slot = index  # Deeper, or the old entry is stale: take the depth-preferred slot
+            if not same_key and old_data:
+                table[index + 2], table[index + 3] = table[index], old_data  # The old entry moves down
+        else:
+            slot = index + ENTRY_WORDS
+        if move == NO_MOVE and table[slot] ^ table[slot + 1] == key:
+            data |= table[slot + 1] & ((1 << MOVE_BITS) - 1)  # Keep the best move of an earlier search of the key
+        table[slot] = key ^ data
+        table[slot + 1] = data
+
+    def hit_rate(self):
+        return self.hits / self.probes if self.probes else 0.0
+
+    def usage(self):  # The share of entries in use, sampled from the first thousand buckets
+        sample = min(1000, self.bucket_mask + 1) * BUCKET_WORDS
+        return sum(1 for slot in range(1, sample, ENTRY_WORDS) if self.table[slot]) / (sample // ENTRY_WORDS)